@@ -1,38 +1,33 @@
-from flask import Flask, render_template_string, request, session, redirect, url_for
-from akinator import Client
+from flask import Flask, make_response, render_template, request, session, redirect, url_for, jsonify
+from aki_client import Client
+from game_pool import game_pool
+from registrations import RegistrationLog, registry_from_env
 from akinator.exceptions import CantGoBackAnyFurther
+from page_templates import register_page
+from compression import CompressionMiddleware
+from image_cache import ImageProxy
+from metrics import instrument_app
+from profiler import register_profiler
+from tracing import instrument_tracing
+from web_assets import AssetPipeline
+from upstream_guard import UpstreamUnavailable
 import secrets
-import json
-import os
 from datetime import datetime
 
 app = Flask(__name__)
 app.secret_key = secrets.token_hex(16)
 
-# File to store user information
-USER_DATA_FILE = 'user_data.json'
+# Append-only log of user information (one JSON record per line),
+# mirrored into an indexed registry when AKI_REGISTRY_DB is set
+USER_DATA_FILE = 'user_data.jsonl'
+registration_log = RegistrationLog(USER_DATA_FILE, registry=registry_from_env())
+# Carry over registrations from the old JSON array file, once
+registration_log.migrate('user_data.json')
 
 def save_user_info(user_info):
-    """Save user information to a JSON file"""
-    try:
-        # Load existing data
-        if os.path.exists(USER_DATA_FILE):
-            with open(USER_DATA_FILE, 'r') as f:
-                data = json.load(f)
-        else:
-            data = []
-        
-        # Add timestamp
-        user_info['timestamp'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        
-        # Append new user
-        data.append(user_info)
-        
-        # Save back to file
-        with open(USER_DATA_FILE, 'w') as f:
-            json.dump(data, f, indent=4)
-    except Exception as e:
-        print(f"Error saving user data: {e}")
+    """Queue user information for the registration log"""
+    record = dict(user_info, timestamp=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+    registration_log.append(record)
 
 # HTML Template
 HTML_TEMPLATE = """
@@ -708,40 +703,92 @@ HTML_TEMPLATE = """
                     </div>
                 </div>
                 <div class="game-stats">
-                    <div class="step-counter">Q{{ step + 1 }}</div>
-                    <div class="step-label">{{ progression|round }}%</div>
+                    <div class="step-counter" id="stepCounter">Q{{ step + 1 }}</div>
+                    <div class="step-label" id="stepLabel">{{ progression|round }}%</div>
                 </div>
             </div>
             
             <div class="game-content">
                 <div class="question-box">
-                    <div class="question-text">{{ question }}</div>
+                    <div class="question-text" id="questionText">{{ question }}</div>
                 </div>
                 
                 <div class="progress-section">
                     <div class="progress-bar">
-                        <div class="progress-fill" style="width: {{ progression }}%;"></div>
+                        <div class="progress-fill" id="progressFill" style="width: {{ progression }}%;"></div>
                     </div>
-                    <div class="progress-text">Progress: {{ progression|round }}%</div>
+                    <div class="progress-text" id="progressText">Progress: {{ progression|round }}%</div>
                 </div>
                 
-                {% if error %}
-                <div class="error-message">{{ error }}</div>
-                {% endif %}
+                <div class="error-message" id="answerError" {% if not error %}hidden{% endif %}>{{ error }}</div>
                 
-                <form method="POST" action="{{ url_for('answer') }}">
+                <form method="POST" action="{{ url_for('answer') }}" id="answerForm">
                     <div class="answer-grid">
                         <button type="submit" name="answer" value="y" class="btn-answer btn-yes">✓ Yes</button>
                         <button type="submit" name="answer" value="n" class="btn-answer btn-no">✗ No</button>
                         <button type="submit" name="answer" value="i" class="btn-answer btn-idk">? Don't Know</button>
                         <button type="submit" name="answer" value="p" class="btn-answer btn-probably">Probably</button>
                         <button type="submit" name="answer" value="pn" class="btn-answer btn-probably-not">Probably Not</button>
-                        <button type="submit" name="answer" value="b" class="btn-answer btn-back" {% if step == 0 %}disabled{% endif %}>← Back</button>
+                        <button type="submit" name="answer" value="b" class="btn-answer btn-back" id="backButton" {% if step == 0 %}disabled{% endif %}>← Back</button>
                     </div>
                 </form>
             </div>
         </div>
         
+        <script>
+            // Answer in place: post the answer for JSON and patch the question,
+            // step and progress. Without JS the form still posts and redirects.
+            document.getElementById('answerForm').addEventListener('submit', async function (event) {
+                if (!event.submitter || !window.fetch) {
+                    return;
+                }
+                event.preventDefault();
+                
+                const buttons = this.querySelectorAll('button');
+                const backButton = document.getElementById('backButton');
+                const backWasDisabled = backButton.disabled;
+                buttons.forEach(btn => btn.disabled = true);
+                const body = new FormData();
+                body.append('answer', event.submitter.value);
+                
+                let ok = false;
+                let data = {};
+                try {
+                    const response = await fetch(this.action, {
+                        method: 'POST',
+                        body: body,
+                        headers: { 'Accept': 'application/json' }
+                    });
+                    ok = response.ok;
+                    data = (await response.json()) || {};
+                } catch (err) {
+                    ok = false;
+                }
+                
+                if (ok && data.redirect) {
+                    window.location.href = data.redirect;
+                    return;
+                }
+                
+                // On an error response leave the question, step and buttons as they were
+                if (ok && data.question !== undefined) {
+                    document.getElementById('questionText').textContent = data.question;
+                    document.getElementById('stepCounter').textContent = 'Q' + (data.step + 1);
+                    document.getElementById('stepLabel').textContent = data.progress + '%';
+                    document.getElementById('progressText').textContent = 'Progress: ' + data.progress + '%';
+                    document.getElementById('progressFill').style.width = data.progression + '%';
+                }
+                
+                const message = data.error || (ok ? '' : 'Connection problem, please try again.');
+                const error = document.getElementById('answerError');
+                error.textContent = message;
+                error.hidden = !message;
+                
+                buttons.forEach(btn => btn.disabled = false);
+                backButton.disabled = ok && data.step !== undefined ? data.step === 0 : backWasDisabled;
+            });
+        </script>
+        
         {% elif stage == 'guess' %}
         <div class="guess-container">
             <div class="guess-content">
@@ -798,10 +845,25 @@ HTML_TEMPLATE = """
 </html>
 """
 
+# Inline CSS and scripts are served as content-hashed, long-cached assets;
+# the page itself is compiled once at startup and reused by every request
+assets = AssetPipeline(app)
+# Pages and assets are compressed once per distinct body and reused from cache
+app.wsgi_app = CompressionMiddleware(app.wsgi_app)
+# Per-route latency and in-flight gauges, served with the upstream metrics at /metrics
+instrument_app(app)
+# Admin-only /debug/profile sampling profiler, enabled by AKI_ADMIN_TOKEN
+register_profiler(app)
+# A sampled share of requests is traced stage by stage to traces.jsonl (see tracing.py)
+instrument_tracing(app)
+# Guess photos are proxied through /img/ and cached on local disk
+images = ImageProxy(app)
+PAGE = register_page(app, 'mind_reader.html', assets.extract(HTML_TEMPLATE, 'mind_reader'))
+
 @app.route('/')
 def index():
     session.clear()
-    return render_template_string(HTML_TEMPLATE, stage='info')
+    return render_template(PAGE, stage='info')
 
 @app.route('/start', methods=['POST'])
 def start_game():
@@ -813,7 +875,7 @@ def start_game():
     session['user_info'] = user_info
     save_user_info(user_info)
     
-    return render_template_string(HTML_TEMPLATE, 
+    return render_template(PAGE, 
         stage='welcome',
         user_info=user_info
     )
@@ -827,60 +889,82 @@ def begin_game():
     theme = request.form.get('theme', 'c')
     child_mode = request.form.get('child_mode', 'false') == 'true'
     
-    client = Client()
     try:
-        # Start game with selected theme and child_mode
-        client.start_game(language='en', theme=theme, child_mode=child_mode)
-        
-        session['question'] = client.question
-        session['step'] = client.step
-        session['progression'] = client.progression
-        session['session_id'] = client.session_id
-        session['signature'] = client.signature
-        session['identifiant'] = client.identifiant
-        session['language'] = client.language
-        session['theme'] = client.theme
-        session['child_mode'] = client.child_mode
+        # Start game with selected theme and child_mode, pre-started when one is ready
+        client = game_pool.start_game(language='en', theme=theme, child_mode=child_mode)
+        session['game'] = client.to_state()
         
         return redirect(url_for('game'))
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
-        return render_template_string(HTML_TEMPLATE, stage='info', error=str(e))
+        return render_template(PAGE, stage='info', error=str(e))
 
 @app.route('/game')
 def game():
-    if 'user_info' not in session:
+    if 'user_info' not in session or 'game' not in session:
         return redirect(url_for('index'))
     
-    if session.get('win') and not session.get('finished'):
-        return render_template_string(HTML_TEMPLATE, 
+    client = Client.from_state(session['game'])
+    
+    if client.win and not client.finished:
+        return render_template(PAGE, 
             stage='guess',
             user_info=session['user_info'],
-            guess=session.get('guess', {}),
+            guess={
+                'name': client.name_proposition,
+                'description': client.description_proposition,
+                'photo': images.photo_url(client),
+                'pseudo': client.pseudo
+            },
             error=session.pop('error', None)
         )
     
-    if session.get('finished'):
-        return render_template_string(HTML_TEMPLATE,
+    if client.finished:
+        return render_template(PAGE,
             stage='finished',
-            win=session.get('win', False),
-            name=session.get('name'),
-            description=session.get('description'),
-            photo=session.get('photo'),
-            final_message=session.get('final_message', '')
+            win=client.win,
+            name=client.name_proposition if client.photo else None,
+            description=client.description_proposition if client.photo else None,
+            photo=images.photo_url(client),
+            final_message=client.question or ''
         )
     
-    return render_template_string(HTML_TEMPLATE,
+    return render_template(PAGE,
         stage='game',
         user_info=session['user_info'],
-        question=session.get('question', ''),
-        step=session.get('step', 0),
-        progression=session.get('progression', 0),
+        question=client.question or '',
+        step=client.step or 0,
+        progression=client.progression or 0,
         error=session.pop('error', None)
     )
 
+def wants_json():
+    return request.accept_mimetypes.best == 'application/json'
+
+def answer_response(client, error=None):
+    """JSON patch for the in-page script, or the redirect for plain form posts"""
+    # The guess and result pages have their own layout, so those load in full
+    if not wants_json() or client.win or client.finished:
+        if error:
+            session['error'] = error
+        if wants_json():
+            return jsonify({'redirect': url_for('game')})
+        return redirect(url_for('game'))
+    
+    return jsonify({
+        'question': client.question,
+        'step': client.step,
+        'progression': client.progression,
+        'progress': str(round(float(client.progression), 0)),
+        'error': error
+    })
+
 @app.route('/answer', methods=['POST'])
 def answer():
-    if 'user_info' not in session:
+    if 'user_info' not in session or 'game' not in session:
+        if wants_json():
+            return jsonify({'redirect': url_for('index')})
         return redirect(url_for('index'))
     
     answer_value = request.form['answer']
@@ -888,94 +972,51 @@ def answer():
     if answer_value == 'b':
         return handle_back()
     
-    client = Client()
-    client.session_id = session['session_id']
-    client.signature = session['signature']
-    client.identifiant = session['identifiant']
-    client.language = session['language']
-    client.theme = session['theme']
-    client.child_mode = session['child_mode']
-    client.question = session['question']
-    client.step = session['step']
-    client.progression = session['progression']
-    client.win = session.get('win', False)
-    client.finished = session.get('finished', False)
-    
-    if session.get('win'):
-        client.id_proposition = session.get('id_proposition', '')
-        client.name_proposition = session.get('name_proposition', '')
-        client.description_proposition = session.get('description_proposition', '')
-        client.photo = session.get('photo', '')
-        client.pseudo = session.get('pseudo', '')
-        client.flag_photo = session.get('flag_photo', '')
-        client.step_last_proposition = session.get('step_last_proposition', 0)
+    client = Client.from_state(session['game'])
     
     try:
         client.answer(answer_value)
+        if client.win:
+            # Start downloading the guess photo before the browser asks for it
+            images.prefetch_photo(client)
+        session['game'] = client.to_state()
         
-        session['question'] = str(client)
-        session['step'] = client.step
-        session['progression'] = client.progression
-        session['finished'] = client.finished
-        session['win'] = client.win
-        
-        if client.win and not client.finished:
-            session['guess'] = {
-                'name': client.name_proposition,
-                'description': client.description_proposition,
-                'photo': client.photo,
-                'pseudo': client.pseudo
-            }
-            session['id_proposition'] = client.id_proposition
-            session['name_proposition'] = client.name_proposition
-            session['description_proposition'] = client.description_proposition
-            session['photo'] = client.photo
-            session['pseudo'] = client.pseudo
-            session['flag_photo'] = client.flag_photo
-            session['step_last_proposition'] = client.step
-        
-        if client.finished:
-            session['final_message'] = client.question
-            if client.photo:
-                session['photo'] = client.photo
-                session['name'] = client.name_proposition
-                session['description'] = client.description_proposition
-        
-        return redirect(url_for('game'))
+        return answer_response(client)
         
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
-        session['error'] = str(e)
-        return redirect(url_for('game'))
+        return answer_response(client, str(e))
 
 def handle_back():
-    client = Client()
-    client.session_id = session['session_id']
-    client.signature = session['signature']
-    client.identifiant = session['identifiant']
-    client.language = session['language']
-    client.theme = session['theme']
-    client.child_mode = session['child_mode']
-    client.question = session['question']
-    client.step = session['step']
-    client.progression = session['progression']
-    client.win = session.get('win', False)
+    client = Client.from_state(session['game'])
     
     try:
         client.back()
+        session['game'] = client.to_state()
         
-        session['question'] = client.question
-        session['step'] = client.step
-        session['progression'] = client.progression
-        session['win'] = False
-        session.pop('guess', None)
-        
-        return redirect(url_for('game'))
+        return answer_response(client)
     except CantGoBackAnyFurther:
-        session['error'] = "You can't go back any further!"
-        return redirect(url_for('game'))
+        return answer_response(client, "You can't go back any further!")
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
-        session['error'] = str(e)
-        return redirect(url_for('game'))
+        return answer_response(client, str(e))
+
+@app.errorhandler(UpstreamUnavailable)
+def upstream_unavailable(e):
+    # Timed out, circuit open or overloaded: answer quickly with 503 and a retry hint
+    message = 'Akinator is busy right now. Please try again in a moment.'
+    if wants_json():
+        response = jsonify({'error': message})
+    elif request.endpoint == 'answer':
+        session['error'] = message
+        response = make_response(game())
+    else:
+        response = make_response(render_template(PAGE, stage='info', error=message))
+    response.status_code = 503
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
 
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
\ No newline at end of file
@@ -0,0 +1,286 @@
+# Non-blocking HTTP transport for aki_client.AsyncClient.
+#
+# akinator.AsyncCloudScraper runs every request through asyncio.to_thread, so
+# each in-flight game pins an executor thread for the whole upstream round
+# trip. AsyncTransport speaks HTTP/1.1 over asyncio streams instead: TLS,
+# keep-alive, a small connection pool per host and a cookie jar per host. Only
+# when Cloudflare answers with a challenge page does it hand the request to
+# the cloudscraper path (in a thread) and adopt the cookies it earns. Clearance
+# earned by any scraper in the process (clearance.py) is adopted as well.
+
+import asyncio
+import gzip
+import json as jsonlib
+import ssl
+import time
+import weakref
+import zlib
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode, urljoin, urlsplit
+
+from akinator.async_client import AsyncCloudScraper
+from requests import Response
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from clearance import clearances
+from user_agents import CachedUserAgent
+
+DEFAULT_MAX_PER_HOST = 64
+DEFAULT_KEEPALIVE = 30.0
+DEFAULT_TIMEOUT = 30.0
+MAX_REDIRECTS = 5
+
+
+def is_challenge(response):
+    """Cheap check for a Cloudflare challenge or block page."""
+    return (
+        response.status_code in (403, 429, 503)
+        and response.headers.get('Server', '').startswith('cloudflare')
+        and b'/cdn-cgi/' in response.content
+    )
+
+
+class _HostPool:
+    """Idle keep-alive connections and a concurrency cap for one host, on one event loop."""
+
+    def __init__(self, max_per_host):
+        self.idle = []
+        self.slots = asyncio.Semaphore(max_per_host)
+
+
+class AsyncTransport:
+    """
+    A shared, non-blocking replacement for `AsyncCloudScraper`.
+
+    One instance can drive any number of concurrent games; connection pools are
+    kept per event loop so the instance is safe to share between loops too.
+    """
+
+    def __init__(self, max_per_host=DEFAULT_MAX_PER_HOST, keepalive=DEFAULT_KEEPALIVE, timeout=DEFAULT_TIMEOUT):
+        self.max_per_host = max_per_host
+        self.keepalive = keepalive
+        self.timeout = timeout
+
+        user_agent = CachedUserAgent(allow_brotli=False)
+        self.headers = dict(user_agent.headers)
+        self.ssl_context = ssl.create_default_context()
+        self.ssl_context.set_ciphers(':'.join(user_agent.cipherSuite))
+        self.ssl_context.set_alpn_protocols(['http/1.1'])
+
+        self.cookies = {}
+        self._clearance_versions = {}
+        self.challenges = 0
+        self._fallback = None
+        self._loops = weakref.WeakKeyDictionary()
+
+    async def post(self, url, data=None, json=None, **kwargs):
+        """Perform a POST request, following redirects when `allow_redirects` is set."""
+        return await self.request('POST', url, data=data, json=json, **kwargs)
+
+    async def request(self, method, url, data=None, json=None, allow_redirects=False, timeout=None, **kwargs):
+        """`timeout` is seconds for the whole exchange, or a (connect, read) pair as in requests."""
+        timeout = timeout or self.timeout
+        connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+        total = connect + read if isinstance(timeout, tuple) else timeout
+        headers = {}
+        body = b''
+        if json is not None:
+            body = jsonlib.dumps(json).encode()
+            headers['Content-Type'] = 'application/json'
+        elif data is not None:
+            body = urlencode(data).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+
+        async def run():
+            response = await self._send(method, url, headers, body, connect)
+            for _ in range(MAX_REDIRECTS):
+                if not (allow_redirects and response.is_redirect):
+                    break
+                location = urljoin(response.url, response.headers['Location'])
+                if response.status_code in (301, 302, 303):
+                    response = await self._send('GET', location, {}, b'', connect)
+                else:
+                    response = await self._send(method, location, headers, body, connect)
+            return response
+
+        self._adopt(urlsplit(url).hostname)
+        response = await asyncio.wait_for(run(), total)
+
+        if is_challenge(response):
+            self.challenges += 1
+            response = await self._solve(method, url, data=data, json=json, allow_redirects=allow_redirects,
+                                         timeout=(connect, read), **kwargs)
+        return response
+
+    def _adopt(self, host):
+        entry = clearances.get(host)
+        if entry is None or self._clearance_versions.get(host) == entry['version']:
+            return
+        self.cookies.setdefault(host, {}).update((cookie['name'], cookie['value']) for cookie in entry['cookies'])
+        if entry['user_agent']:
+            self.headers['User-Agent'] = entry['user_agent']
+        self._clearance_versions[host] = entry['version']
+
+    async def _solve(self, method, url, **kwargs):
+        if self._fallback is None:
+            self._fallback = AsyncCloudScraper()
+            self._fallback.scraper.headers.update(self.headers)
+        scraper = self._fallback.scraper
+        clearances.apply(scraper, urlsplit(url).hostname)
+        response = await asyncio.to_thread(scraper.request, method, url, **kwargs)
+        # Keep the clearance cookies so the next requests stay on the native path
+        host = urlsplit(url).hostname
+        jar = self.cookies.setdefault(host, {})
+        for cookie in scraper.cookies:
+            if host.endswith(cookie.domain.lstrip('.')):
+                jar[cookie.name] = cookie.value
+        return response
+
+    def _pool(self, host, port):
+        pools = self._loops.setdefault(asyncio.get_running_loop(), {})
+        if (host, port) not in pools:
+            pools[host, port] = _HostPool(self.max_per_host)
+        return pools[host, port]
+
+    async def _send(self, method, url, extra_headers, body, connect_timeout):
+        parts = urlsplit(url)
+        host = parts.hostname
+        secure = parts.scheme == 'https'
+        port = parts.port or (443 if secure else 80)
+        target = parts.path or '/'
+        if parts.query:
+            target += '?' + parts.query
+
+        lines = [f'{method} {target} HTTP/1.1', f'Host: {parts.netloc}']
+        lines += [f'{name}: {value}' for name, value in {**self.headers, **extra_headers}.items()]
+        jar = self.cookies.get(host)
+        if jar:
+            lines.append('Cookie: ' + '; '.join(f'{name}={value}' for name, value in jar.items()))
+        lines.append(f'Content-Length: {len(body)}')
+        request = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body
+
+        pool = self._pool(host, port)
+        async with pool.slots:
+            now = time.monotonic()
+            while pool.idle:
+                reader, writer, last_used = pool.idle.pop()
+                if now - last_used < self.keepalive and not writer.is_closing() and not reader.at_eof():
+                    break
+                writer.close()
+            else:
+                reader = writer = None
+
+            try:
+                reused = reader is not None
+                if not reused:
+                    reader, writer = await asyncio.wait_for(self._connect(host, port, secure), connect_timeout)
+                try:
+                    writer.write(request)
+                    status_line = await reader.readline()
+                    if not status_line:
+                        raise ConnectionResetError('Connection closed by upstream.')
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    if not reused:
+                        raise
+                    # The server dropped an idle keep-alive connection; nothing was processed
+                    writer.close()
+                    reader, writer = await asyncio.wait_for(self._connect(host, port, secure), connect_timeout)
+                    writer.write(request)
+                    status_line = await reader.readline()
+
+                response, keep_alive = await self._read_response(reader, status_line, url, method)
+            except BaseException:
+                if writer is not None:
+                    writer.close()
+                raise
+
+            if keep_alive:
+                pool.idle.append((reader, writer, time.monotonic()))
+            else:
+                writer.close()
+
+        self._store_cookies(host, response)
+        return response
+
+    async def _connect(self, host, port, secure):
+        if secure:
+            return await asyncio.open_connection(host, port, ssl=self.ssl_context, server_hostname=host)
+        return await asyncio.open_connection(host, port)
+
+    async def _read_response(self, reader, status_line, url, method='GET'):
+        version, status, *_ = status_line.decode('latin-1').split(' ', 2)
+        status = int(status)
+        headers = CaseInsensitiveDict()
+        cookies = []
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            name, value = name.strip(), value.strip()
+            if name.lower() == 'set-cookie':
+                cookies.append(value)
+            headers[name] = f'{headers[name]}, {value}' if name in headers else value
+
+        if 100 <= status < 200:
+            # Interim response (100 Continue, 103 Early Hints): the real one follows
+            return await self._read_response(reader, await reader.readline(), url, method)
+
+        keep_alive = version == 'HTTP/1.1' and headers.get('Connection', '').lower() != 'close'
+        if method == 'HEAD' or status in (204, 304):
+            content = b''
+        elif headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';', 1)[0], 16)
+                if not size:
+                    # Trailer section ends with an empty line
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            content = b''.join(chunks)
+        elif 'Content-Length' in headers:
+            content = await reader.readexactly(int(headers['Content-Length']))
+        elif not keep_alive:
+            # Delimited by the server closing the connection
+            content = await reader.read()
+        else:
+            # A keep-alive response without a length has no body; reading to EOF would hang
+            content = b''
+
+        encoding = headers.get('Content-Encoding', '').lower()
+        if encoding == 'gzip':
+            content = gzip.decompress(content)
+        elif encoding == 'deflate':
+            content = zlib.decompress(content)
+
+        response = Response()
+        response.status_code = status
+        response.headers = headers
+        response.encoding = get_encoding_from_headers(headers)
+        response.url = url
+        response._content = content
+        response.raw_cookies = cookies
+        return response, keep_alive
+
+    def _store_cookies(self, host, response):
+        if not response.raw_cookies:
+            return
+        jar = self.cookies.setdefault(host, {})
+        for header in response.raw_cookies:
+            parsed = SimpleCookie()
+            try:
+                parsed.load(header)
+            except Exception:
+                continue
+            for name, morsel in parsed.items():
+                if morsel['max-age'] == '0' or morsel['expires'].startswith('Thu, 01 Jan 1970'):
+                    jar.pop(name, None)
+                else:
+                    jar[name] = morsel.value
+
+
+shared_async_transport = AsyncTransport()
@@ -0,0 +1,507 @@
+# Akinator clients used by the Flask apps.
+#
+# Thin subclasses of akinator.Client / akinator.AsyncClient that default to the
+# pooled upstream transport and can be snapshotted to, and rebuilt from, a
+# compact state blob that fits in a cookie session.
+#
+# Every upstream call also runs under a budget: separate connect and read
+# timeouts for each HTTP request, and an overall deadline for the whole call
+# (which may take more than one request, e.g. to get past a challenge). Running
+# out of either raises UpstreamTimeout instead of holding the worker.
+#
+# Requests also pass through the per-host circuit breakers and the global
+# upstream concurrency limit from upstream_guard.
+#
+# start_game, and only start_game, can be hedged (see hedging.py): it is the
+# one call with no upstream side effects. Opt in per client or per call, or
+# for every client with AKI_HEDGE_START=1.
+#
+# Latency, outcome, response size, challenge and 'KO - TIMEOUT' metrics are
+# recorded per operation for /metrics. On traced requests, rehydrating a
+# client, each upstream request and parsing its body are recorded as spans.
+#
+# Upstream bodies are parsed from bytes: JSON straight from the content, and
+# the start and win pages with precompiled bytes patterns, decoding only the
+# captured fields (Akinator serves UTF-8). Whole pages are never decoded and
+# requests' charset detection never runs.
+
+import asyncio
+import json
+import os
+import re
+import time
+from contextlib import contextmanager
+from html import unescape
+from urllib.parse import urlsplit
+
+import akinator
+from akinator.client import LANG_MAP, THEME_IDS, THEME_MAP
+from akinator.exceptions import InvalidLanguageError, InvalidThemeError
+from requests.exceptions import Timeout
+
+from aki_async import is_challenge, shared_async_transport
+from aki_transport import shared_session
+from hedging import start_hedger
+from metrics import (upstream_calls, upstream_challenges, upstream_ko_timeouts, upstream_latency,
+                     upstream_response_bytes, upstream_timeouts)
+from tracing import span
+from upstream_guard import UpstreamUnavailable, breakers, upstream_limiter
+
+STATE_VERSION = 1
+
+DEFAULT_CONNECT_TIMEOUT = float(os.environ.get('AKI_CONNECT_TIMEOUT', 3.05))
+DEFAULT_READ_TIMEOUT = float(os.environ.get('AKI_READ_TIMEOUT', 10))
+DEFAULT_DEADLINE = float(os.environ.get('AKI_DEADLINE', 20))
+HEDGE_START = os.environ.get('AKI_HEDGE_START', '').lower() in ('1', 'true', 'yes')
+
+ENCODING = 'utf-8'
+SESSION_RE = re.compile(rb"#session'\).val\('(.+?)'\)")
+SIGNATURE_RE = re.compile(rb"#signature'\).val\('(.+?)'\)")
+IDENTIFIANT_RE = re.compile(rb"#identifiant'\).val\('(.+?)'\)")
+QUESTION_RE = re.compile(rb'<div class="bubble-body"><p class="question-text" id="question-label">(.+)</p></div>')
+PROPOSITION_RE = re.compile(rb'<div class="sub-bubble-propose"><p id="p-sub-bubble">([^<]+)</p></div>')
+WIN_SENTENCE_RE = re.compile(rb'<span class="win-sentence">(.+?)</span>')
+ALREADY_PLAYED_RE = re.compile(rb'let tokenDejaJoue = "([^"]+)";')
+TIMES_SELECTED_RE = re.compile(rb'let timesSelected = "(\d+)";')
+TIMES_RE = re.compile(rb'<span id="timesselected"></span>\s+([^<]+)</span>')
+# akinator matches these fields with [\w\s]+, which in bytes patterns would be ASCII-only
+WORDS_RE = re.compile(r'[\w\s]+')
+TECHNICAL_PROBLEM = b'A technical problem has ocurred.'
+
+# Order matters: this is the layout of the state blob for STATE_VERSION.
+STATE_FIELDS = (
+    'language',
+    'theme',
+    'child_mode',
+    'session_id',
+    'signature',
+    'identifiant',
+    'question',
+    'step',
+    'progression',
+    'akitude',
+    'step_last_proposition',
+    'finished',
+    'win',
+    'completion',
+    'proposition',
+    'id_proposition',
+    'name_proposition',
+    'description_proposition',
+    'photo',
+    'pseudo',
+    'flag_photo',
+)
+
+
+class UpstreamTimeout(UpstreamUnavailable, TimeoutError):
+    """Raised when Akinator doesn't answer within the call's timeouts or deadline."""
+
+    def __init__(self, message="Akinator took too long to respond."):
+        super().__init__(message)
+
+
+class TimedSession:
+    """Wraps a transport so each request gets the current call's timeouts and remaining deadline."""
+
+    def __init__(self, session):
+        self.session = session
+        self.timeout = (DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT)
+        self.deadline_at = None
+        self.operation = 'other'
+
+    def _observe(self, response):
+        content = response.content
+        upstream_response_bytes.observe(self.operation, value=len(content))
+        if b'KO - TIMEOUT' in content:
+            upstream_ko_timeouts.inc(self.operation)
+        if is_challenge(response) or any(is_challenge(earlier) for earlier in response.history):
+            upstream_challenges.inc(self.operation)
+
+    def _budget(self):
+        connect, read = self.timeout
+        if self.deadline_at is None:
+            return connect, read, None
+        remaining = self.deadline_at - time.monotonic()
+        if remaining <= 0:
+            raise UpstreamTimeout("Deadline exceeded before the request was sent.")
+        return min(connect, remaining), min(read, remaining), remaining
+
+    def request(self, method, url, **kwargs):
+        _, _, remaining = self._budget()
+        with upstream_limiter.slot(remaining):
+            connect, read, _ = self._budget()
+            kwargs.setdefault('timeout', (connect, read))
+            breaker = breakers.get(urlsplit(url).hostname)
+            ticket = breaker.before()
+            started = time.monotonic()
+            try:
+                with span(f'upstream_{method.lower()}'):
+                    response = self.session.request(method, url, **kwargs)
+            except Timeout as e:
+                breaker.record(ticket, False, time.monotonic() - started)
+                raise UpstreamTimeout() from e
+            except Exception:
+                breaker.record(ticket, False, time.monotonic() - started)
+                raise
+            except BaseException:
+                breaker.release(ticket)
+                raise
+            breaker.record(ticket, response.status_code < 500 and response.status_code != 429,
+                           time.monotonic() - started)
+            self._observe(response)
+            return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, data=None, json=None, **kwargs):
+        return self.request('POST', url, data=data, json=json, **kwargs)
+
+
+class AsyncTimedSession(TimedSession):
+    """`TimedSession` for awaitable transports; the deadline also bounds the whole request."""
+
+    async def post(self, url, data=None, json=None, **kwargs):
+        _, _, remaining = self._budget()
+        async with upstream_limiter.async_slot(remaining):
+            connect, read, remaining = self._budget()
+            kwargs.setdefault('timeout', (connect, read))
+            breaker = breakers.get(urlsplit(url).hostname)
+            ticket = breaker.before()
+            started = time.monotonic()
+            try:
+                with span('upstream_post'):
+                    response = await asyncio.wait_for(self.session.post(url, data=data, json=json, **kwargs), remaining)
+            except (asyncio.TimeoutError, Timeout) as e:
+                breaker.record(ticket, False, time.monotonic() - started)
+                raise UpstreamTimeout() from e
+            except Exception:
+                breaker.record(ticket, False, time.monotonic() - started)
+                raise
+            except BaseException:
+                # Cancelled, e.g. the losing attempt of a hedge: not an upstream failure
+                breaker.release(ticket)
+                raise
+            breaker.record(ticket, response.status_code < 500 and response.status_code != 429,
+                           time.monotonic() - started)
+            self._observe(response)
+            return response
+
+
+class BudgetMixin:
+    """Per-client default timeouts and deadline, overridable on every upstream call."""
+
+    def _init_budget(self, timeout, deadline, hedge):
+        self.timeout = timeout or (DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT)
+        self.deadline = deadline or DEFAULT_DEADLINE
+        self.hedge = HEDGE_START if hedge is None else hedge
+
+    def _attempt(self):
+        # Each hedged attempt needs its own game state and per-call budget
+        return type(self)(self.session.session, self.timeout, self.deadline, hedge=False)
+
+    @contextmanager
+    def budget(self, timeout=None, deadline=None, operation='other'):
+        """
+        Apply `timeout` (seconds, or a (connect, read) pair) to each request in the
+        block and `deadline` seconds to the block as a whole, and record it as `operation`.
+        """
+        session = self.session
+        # A nested call, e.g. answer() -> choose(), runs under the outer budget
+        outer = session.deadline_at is None
+        if outer:
+            timeout = timeout or self.timeout
+            session.timeout = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+            session.deadline_at = time.monotonic() + (deadline or self.deadline)
+        enclosing, session.operation = session.operation, operation
+        started = time.perf_counter()
+        outcome = 'error'
+        try:
+            try:
+                yield
+            except RuntimeError as e:
+                # akinator wraps transport errors in RuntimeError; surface timeouts and refusals as themselves
+                if isinstance(e.__cause__, UpstreamUnavailable):
+                    raise e.__cause__
+                raise
+            outcome = 'ok'
+        except UpstreamTimeout:
+            outcome = 'timeout'
+            upstream_timeouts.inc(operation)
+            raise
+        except UpstreamUnavailable:
+            outcome = 'unavailable'
+            raise
+        finally:
+            upstream_latency.observe(operation, value=time.perf_counter() - started)
+            upstream_calls.inc(operation, outcome)
+            session.operation = enclosing
+            if outer:
+                session.deadline_at = None
+
+
+class StateMixin:
+    """Snapshot and restore the game state of a client, never its transport."""
+
+    def to_state(self):
+        """Return the game state as a versioned tuple."""
+        return (STATE_VERSION,) + tuple(getattr(self, field) for field in STATE_FIELDS)
+
+    def load_state(self, state):
+        """Restore the game state from a blob produced by `to_state`."""
+        if not state or state[0] != STATE_VERSION or len(state) != len(STATE_FIELDS) + 1:
+            raise ValueError("Unsupported or corrupt client state.")
+        for field, value in zip(STATE_FIELDS, state[1:]):
+            setattr(self, field, value)
+        return self
+
+    @classmethod
+    def from_state(cls, state, session=None):
+        """Build a client from a blob produced by `to_state`."""
+        with span('rehydrate'):
+            return cls(session).load_state(state)
+
+
+def _field(pattern, content, words=False):
+    match = pattern.search(content)
+    if match is None:
+        return None
+    value = match.group(1).decode(ENCODING, 'replace')
+    if words and not WORDS_RE.fullmatch(value):
+        return None
+    return value
+
+
+class ParseMixin:
+    """The parsing half of akinator's client, working on response bytes instead of response.text."""
+
+    def _game_request(self, language='en', child_mode=False, theme='c'):
+        """Validate start_game's arguments as akinator does, and return the URL and form to post."""
+        if language not in LANG_MAP and language not in LANG_MAP.values():
+            raise InvalidLanguageError(
+                f"Unsupported language: {language}. Supported languages: {', '.join(LANG_MAP.keys())}")
+        if theme not in THEME_IDS and theme not in THEME_IDS.values():
+            raise InvalidThemeError(f"Unsupported theme: {theme}. Supported themes: {', '.join(THEME_IDS.keys())}")
+        if theme not in THEME_MAP[LANG_MAP.get(language.lower(), language.lower())]:
+            raise InvalidThemeError(f"Theme '{theme}' is not available for language '{language}'.")
+
+        self.theme = theme
+        self.language = LANG_MAP.get(language.lower(), language.lower())
+        self.child_mode = child_mode
+        return f"https://{self.language}.akinator.com/game", {"sid": THEME_IDS[theme], "cm": str(child_mode).lower()}
+
+    def _parse_game(self, content):
+        """Read the session and first question from the start page."""
+        with span('html_parse'):
+            self.session_id = _field(SESSION_RE, content)
+            self.signature = _field(SIGNATURE_RE, content)
+            self.identifiant = _field(IDENTIFIANT_RE, content)
+            if not all([self.session_id, self.signature, self.identifiant]):
+                raise ValueError("Failed to extract session information from the response.")
+
+            question = _field(QUESTION_RE, content)
+            if not question:
+                raise ValueError("Failed to extract the initial question from the response.")
+            self.question = unescape(question)
+
+            proposition = _field(PROPOSITION_RE, content, words=True)
+            if not proposition:
+                raise ValueError("Failed to extract the proposition from the response.")
+            self.proposition = unescape(proposition)
+
+        self.progression = 0
+        self.step = 0
+        self.akitude = "defi.png"
+
+    def _load(self, response):
+        """The JSON body of an answer, back or exclude response."""
+        response.raise_for_status()
+        content = response.content
+        try:
+            with span('json_parse'):
+                return json.loads(content)
+        except ValueError as e:
+            if TECHNICAL_PROBLEM in content:
+                raise RuntimeError("A technical problem has occurred. Please try again later.") from e
+            raise RuntimeError("Failed to parse the response as JSON.") from e
+
+    def _apply(self, data):
+        """Update the game from a JSON response, as akinator's handler does. True if the game is lost."""
+        lost = False
+        if "completion" not in data:
+            data["completion"] = self.completion
+        if data["completion"] == "KO - TIMEOUT":
+            raise RuntimeError("The session has timed out. Please start a new game.")
+        if data["completion"] == "SOUNDLIKE":
+            self.finished = True
+            self.win = True
+            lost = not self.id_proposition
+        elif "id_proposition" in data:
+            self.win = True
+            self.id_proposition = data["id_proposition"]
+            self.name_proposition = data["name_proposition"]
+            self.description_proposition = data["description_proposition"]
+            self.step_last_proposition = self.step
+            self.pseudo = data["pseudo"]
+            self.flag_photo = data["flag_photo"]
+            self.photo = data["photo"]
+        else:
+            self.akitude = data["akitude"]
+            self.step = int(data["step"])
+            self.progression = float(data["progression"])
+            self.question = data["question"]
+        self.completion = data["completion"]
+        return lost
+
+    def _choice_request(self):
+        """The URL and form to post to confirm the proposed character."""
+        if not self.win:
+            raise RuntimeError("You can only choose a proposition after Akinator has proposed a win.")
+        return f"https://{self.language}.akinator.com/choice", {
+            "step": self.step,
+            "sid": THEME_IDS[self.theme],
+            "session": self.session_id,
+            "signature": self.signature,
+            "identifiant": self.identifiant,
+            "pid": self.id_proposition,
+            "charac_name": self.name_proposition,
+            "charac_description": self.description_proposition,
+            "pflag_photo": self.flag_photo,
+        }
+
+    def _chosen(self, response):
+        if response.status_code not in range(200, 400):
+            response.raise_for_status()
+        self.finished = True
+        self.win = True
+        self.akitude = "triomphe.png"
+        self.id_proposition = ""
+
+    def _parse_choice(self, content):
+        """Read the closing message from the win page; it is optional, as in akinator."""
+        with span('html_parse'):
+            fields = (
+                _field(WIN_SENTENCE_RE, content),
+                _field(ALREADY_PLAYED_RE, content, words=True),
+                _field(TIMES_SELECTED_RE, content),
+                _field(TIMES_RE, content, words=True),
+            )
+        if all(fields):
+            win_message, already_played, times_selected, times = fields
+            self.question = f"{unescape(win_message)}\n{unescape(already_played)} {times_selected} {unescape(times)}"
+        self.progression = 100
+
+
+class Client(BudgetMixin, StateMixin, ParseMixin, akinator.Client):
+    """An `akinator.Client` that uses the shared transport pool by default and never waits unbounded."""
+
+    def __init__(self, session=None, timeout=None, deadline=None, hedge=None):
+        super().__init__(TimedSession(session or shared_session))
+        self._init_budget(timeout, deadline, hedge)
+
+    def start_game(self, *, timeout=None, deadline=None, hedge=None, **kwargs):
+        if self.hedge if hedge is None else hedge:
+            def attempt():
+                client = self._attempt()
+                client.start_game(timeout=timeout, deadline=deadline, **kwargs)
+                return client.to_state()
+
+            try:
+                state = start_hedger.run(attempt, deadline or self.deadline)
+            except UpstreamTimeout:
+                raise
+            except TimeoutError as e:
+                raise UpstreamTimeout() from e
+            self.load_state(state)
+            return self.session
+        with self.budget(timeout, deadline, 'start_game'):
+            url, data = self._game_request(**kwargs)
+            try:
+                response = self.session.post(url, data=data)
+                response.raise_for_status()
+                self._parse_game(response.content)
+            except Exception as e:
+                raise RuntimeError("Failed to start the game.") from e
+            return self.session
+
+    def _Client__handler(self, response):
+        # Stands in for akinator.Client's private (name-mangled) handler, which reads response.text
+        if self._apply(self._load(response)):
+            self.defeat()
+
+    def answer(self, answer, *, timeout=None, deadline=None):
+        with self.budget(timeout, deadline, 'answer'):
+            return super().answer(answer)
+
+    def back(self, *, timeout=None, deadline=None):
+        with self.budget(timeout, deadline, 'back'):
+            return super().back()
+
+    def exclude(self, *, timeout=None, deadline=None):
+        with self.budget(timeout, deadline, 'exclude'):
+            return super().exclude()
+
+    def choose(self, *, timeout=None, deadline=None):
+        with self.budget(timeout, deadline, 'choose'):
+            url, data = self._choice_request()
+            try:
+                response = self.session.post(url, data=data, allow_redirects=True)
+                self._chosen(response)
+            except Exception as e:
+                raise RuntimeError("Failed to choose the proposition.") from e
+            self._parse_choice(response.content)
+
+
+class AsyncClient(BudgetMixin, StateMixin, ParseMixin, akinator.AsyncClient):
+    """An `akinator.AsyncClient` that uses the shared non-blocking transport by default."""
+
+    def __init__(self, session=None, timeout=None, deadline=None, hedge=None):
+        super().__init__(AsyncTimedSession(session or shared_async_transport))
+        self._init_budget(timeout, deadline, hedge)
+
+    async def start_game(self, *, timeout=None, deadline=None, hedge=None, **kwargs):
+        if self.hedge if hedge is None else hedge:
+            async def attempt():
+                client = self._attempt()
+                await client.start_game(timeout=timeout, deadline=deadline, **kwargs)
+                return client.to_state()
+
+            self.load_state(await start_hedger.run_async(attempt))
+            return self.session
+        with self.budget(timeout, deadline, 'start_game'):
+            url, data = self._game_request(**kwargs)
+            try:
+                response = await self.session.post(url, data=data)
+                response.raise_for_status()
+                self._parse_game(response.content)
+            except Exception as e:
+                raise RuntimeError("Failed to start the game.") from e
+            return self.session
+
+    async def _AsyncClient__handler(self, response):
+        # Stands in for akinator.AsyncClient's private (name-mangled) handler, which reads response.text
+        if self._apply(self._load(response)):
+            await self.defeat()
+
+    async def answer(self, answer, *, timeout=None, deadline=None):
+        with self.budget(timeout, deadline, 'answer'):
+            return await super().answer(answer)
+
+    async def back(self, *, timeout=None, deadline=None):
+        with self.budget(timeout, deadline, 'back'):
+            return await super().back()
+
+    async def exclude(self, *, timeout=None, deadline=None):
+        with self.budget(timeout, deadline, 'exclude'):
+            return await super().exclude()
+
+    async def choose(self, *, timeout=None, deadline=None):
+        with self.budget(timeout, deadline, 'choose'):
+            url, data = self._choice_request()
+            try:
+                response = await self.session.post(url, data=data, allow_redirects=True)
+                self._chosen(response)
+            except Exception as e:
+                raise RuntimeError("Failed to choose the proposition.") from e
+            self._parse_choice(response.content)
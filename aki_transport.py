@@ -0,0 +1,123 @@
+# Shared upstream transport for the Akinator clients used by the Flask apps.
+#
+# Every akinator.Client() normally builds its own CloudScraper (new requests
+# Session, new CipherSuiteAdapter, new SSL context, cold TLS handshake).
+# Instead, clients are handed `shared_session`, which borrows a warm scraper
+# from a process-wide pool for each request and gives it back afterwards.
+#
+# New scrapers take their browser profile from the catalog in user_agents.py,
+# parsed once per process, instead of re-reading browsers.json each time, and
+# share SSL contexts (and TLS sessions) through tls_cache.py. Responses are
+# checked for Cloudflare challenges by the cheaper detector in challenges.py,
+# and every scraper picks up the process-wide clearance from clearance.py
+# before each request, so a challenge solved once serves them all.
+
+import os
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from cloudscraper import create_scraper
+
+import challenges
+import tls_cache
+import user_agents
+from clearance import clearances
+from metrics import registry
+
+challenges.install()
+tls_cache.install()
+user_agents.install()
+
+DEFAULT_POOL_SIZE = int(os.environ.get('AKI_TRANSPORT_POOL_SIZE', 16))
+DEFAULT_BORROW_TIMEOUT = float(os.environ.get('AKI_TRANSPORT_BORROW_TIMEOUT', 30))
+
+
+class TransportPool:
+    """Thread-safe pool of CloudScraper sessions, keyed by upstream host."""
+
+    def __init__(self, size=DEFAULT_POOL_SIZE, borrow_timeout=DEFAULT_BORROW_TIMEOUT, factory=create_scraper):
+        self.size = size
+        self.borrow_timeout = borrow_timeout
+        self.factory = factory
+        self._cond = threading.Condition()
+        self._idle = {}
+        self._created = {}
+
+    def _acquire(self, host):
+        with self._cond:
+            idle = self._idle.setdefault(host, [])
+            if not idle and self._created.get(host, 0) >= self.size:
+                # Wake for a returned scraper, or for a slot freed by a scraper that failed to build
+                available = self._cond.wait_for(
+                    lambda: idle or self._created.get(host, 0) < self.size, timeout=self.borrow_timeout)
+                if not available:
+                    raise RuntimeError(f"No upstream connection to {host} became available.")
+            if idle:
+                # LIFO so the most recently used (warmest) connection goes out first
+                return idle.pop()
+            self._created[host] = self._created.get(host, 0) + 1
+
+        try:
+            return self.factory()
+        except Exception:
+            with self._cond:
+                self._created[host] -= 1
+                self._cond.notify()
+            raise
+
+    def _release(self, host, scraper):
+        with self._cond:
+            self._idle[host].append(scraper)
+            self._cond.notify()
+
+    @contextmanager
+    def borrow(self, host):
+        """Borrow a scraper for `host` for the duration of the block."""
+        scraper = self._acquire(host)
+        try:
+            yield scraper
+        finally:
+            self._release(host, scraper)
+
+    def stats(self):
+        with self._cond:
+            return {
+                host: {'created': created, 'idle': len(self._idle.get(host, ()))}
+                for host, created in self._created.items()
+            }
+
+
+class PooledSession:
+    """
+    Stand-in for a CloudScraper that can be shared by any number of clients and threads.
+
+    Each request borrows a scraper for the target host from the pool, so keep-alive
+    connections and TLS sessions survive across short-lived, rehydrated clients.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def request(self, method, url, *args, **kwargs):
+        host = urlsplit(url).hostname
+        with self.pool.borrow(host) as scraper:
+            clearances.apply(scraper, host)
+            return scraper.request(method, url, *args, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, data=None, json=None, **kwargs):
+        return self.request('POST', url, data=data, json=json, **kwargs)
+
+
+transport_pool = TransportPool()
+shared_session = PooledSession(transport_pool)
+
+
+@registry.collector
+def transport_metrics():
+    for host, stats in transport_pool.stats().items():
+        yield 'aki_transport_scrapers', {'host': host}, stats['created']
+        yield 'aki_transport_idle', {'host': host}, stats['idle']
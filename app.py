@@ -3,15 +3,60 @@
 
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-from akinator import Akinator
-from akinator.exceptions import CantGoBackAnyFurther, InvalidChoiceError
+from akinator.exceptions import CantGoBackAnyFurther, InvalidChoiceError, InvalidLanguageError, InvalidThemeError
+from compression import CompressionMiddleware
+from game_pool import game_pool
+from image_cache import ImageProxy
+from metrics import instrument_app
+from profiler import register_profiler
+from registrations import RegistrationLog, registry_from_env
+from session_store import MemorySessionStore, SessionBusy, SQLiteSessionStore
+from upstream_guard import UpstreamUnavailable
+from datetime import datetime
+import os
 import uuid
 
 app = Flask(__name__)
 CORS(app)
+# gzip/brotli for responses big enough to benefit; tiny JSON answers go out as-is
+app.wsgi_app = CompressionMiddleware(app.wsgi_app)
+# Per-route latency and in-flight gauges, served with the upstream metrics at /metrics
+instrument_app(app)
+# Admin-only /debug/profile sampling profiler, enabled by AKI_ADMIN_TOKEN
+register_profiler(app)
+# Photos and akitudes are served from a local disk cache under /img/
+images = ImageProxy(app)
+images.preload_akitudes()
 
-# Store game sessions in memory (use Redis/database in production)
-sessions = {}
+# Store game sessions in memory, bounded by idle TTL, entry count and approximate size.
+# Set AKI_SESSION_DB to share games between worker processes through SQLite.
+if os.environ.get('AKI_SESSION_DB'):
+    sessions = SQLiteSessionStore(os.environ['AKI_SESSION_DB'])
+else:
+    sessions = MemorySessionStore()
+
+# Player registrations, shared with Guessing_game.py
+registration_log = RegistrationLog('user_data.jsonl', registry=registry_from_env())
+
+def session_error(session_id):
+    if sessions.expired(session_id):
+        return jsonify({'success': False, 'error': 'Session expired', 'expired': True}), 410
+    return jsonify({'success': False, 'error': 'Invalid session'}), 400
+
+def upstream_unavailable(e):
+    # Timed out, circuit open or overloaded: fail fast and say when to retry rather than holding the worker
+    response = jsonify({'success': False, 'error': 'Akinator is busy right now. Please try again in a moment.', 'retry': True})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+@app.errorhandler(SessionBusy)
+def session_busy(e):
+    # Another request for the same game still holds its lock; the client can simply try again
+    response = jsonify({'success': False, 'error': str(e), 'retry': True})
+    response.status_code = 409
+    response.headers['Retry-After'] = '1'
+    return response
 
 @app.route('/api/start', methods=['POST'])
 def start_game():
@@ -22,21 +67,22 @@ def start_game():
     language = data.get('language', 'en')
     theme = data.get('theme', 'c')
     
-    # Create new Akinator client
     session_id = str(uuid.uuid4())
-    client = Akinator()
     
     try:
-        client.start_game()
+        # Take a pre-started Akinator game when one is ready instead of a cold start
+        client = game_pool.start_game(language=language, theme=theme)
         
-        sessions[session_id] = {
-            'client': client,
-            'user_info': {
-                'name': name,
-                'phone': phone,
-                'institution': institution
-            }
+        user_info = {
+            'name': name,
+            'phone': phone,
+            'institution': institution
         }
+        sessions.put(session_id, {
+            'client': client,
+            'user_info': user_info
+        })
+        registration_log.append(dict(user_info, timestamp=datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
         
         return jsonify({
             'success': True,
@@ -44,8 +90,13 @@ def start_game():
             'question': client.question,
             'step': client.step,
             'progression': client.progression,
-            'akitude_url': client.akitude_url
+            'akitude_url': images.akitude_url(client, _external=True),
+            'preload': images.next_akitude_urls(client, _external=True)
         })
+    except (InvalidLanguageError, InvalidThemeError) as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except UpstreamUnavailable as e:
+        return upstream_unavailable(e)
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -55,78 +106,91 @@ def submit_answer():
     session_id = data.get('session_id')
     answer = data.get('answer')
     
-    if session_id not in sessions:
-        return jsonify({'success': False, 'error': 'Invalid session'}), 400
-    
-    client = sessions[session_id]['client']
-    
-    try:
-        client.answer(answer)
+    with sessions.lock(session_id):
+        entry = sessions.get(session_id)
+        if entry is None:
+            return session_error(session_id)
         
-        response = {
-            'success': True,
-            'question': str(client),
-            'step': client.step,
-            'progression': client.progression,
-            'finished': client.finished,
-            'win': client.win,
-            'akitude_url': client.akitude_url
-        }
+        client = entry['client']
         
-        # If Akinator made a guess
-        if client.win and not client.finished:
-            response['guess'] = {
-                'name': client.name_proposition,
-                'description': client.description_proposition,
-                'photo': client.photo,
-                'pseudo': client.pseudo
+        try:
+            previous_akitude = client.akitude
+            client.answer(answer)
+            images.observe(previous_akitude, client.akitude)
+            sessions.put(session_id, entry)
+            
+            response = {
+                'success': True,
+                'question': str(client),
+                'step': client.step,
+                'progression': client.progression,
+                'finished': client.finished,
+                'win': client.win,
+                'akitude_url': images.akitude_url(client, _external=True),
+                'preload': images.next_akitude_urls(client, _external=True)
             }
-        
-        # If game is finished
-        if client.finished:
-            response['final_message'] = client.question
-            if client.photo:
-                response['photo'] = client.photo
-                response['name'] = client.name_proposition
-                response['description'] = client.description_proposition
-        
-        return jsonify(response)
-    except InvalidChoiceError as e:
-        return jsonify({'success': False, 'error': str(e)}), 400
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+            
+            # If Akinator made a guess
+            if client.win and not client.finished:
+                response['guess'] = {
+                    'name': client.name_proposition,
+                    'description': client.description_proposition,
+                    'photo': images.photo_url(client, _external=True),
+                    'pseudo': client.pseudo
+                }
+            
+            # If game is finished
+            if client.finished:
+                response['final_message'] = client.question
+                if client.photo:
+                    response['photo'] = images.photo_url(client, _external=True)
+                    response['name'] = client.name_proposition
+                    response['description'] = client.description_proposition
+            
+            return jsonify(response)
+        except InvalidChoiceError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        except UpstreamUnavailable as e:
+            return upstream_unavailable(e)
+        except Exception as e:
+            return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/back', methods=['POST'])
 def go_back():
     data = request.json
     session_id = data.get('session_id')
     
-    if session_id not in sessions:
-        return jsonify({'success': False, 'error': 'Invalid session'}), 400
-    
-    client = sessions[session_id]['client']
-    
-    try:
-        client.back()
-        return jsonify({
-            'success': True,
-            'question': client.question,
-            'step': client.step,
-            'progression': client.progression,
-            'akitude_url': client.akitude_url
-        })
-    except CantGoBackAnyFurther:
-        return jsonify({'success': False, 'error': "You can't go back any further!"}), 400
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+    with sessions.lock(session_id):
+        entry = sessions.get(session_id)
+        if entry is None:
+            return session_error(session_id)
+        
+        client = entry['client']
+        
+        try:
+            client.back()
+            sessions.put(session_id, entry)
+            return jsonify({
+                'success': True,
+                'question': client.question,
+                'step': client.step,
+                'progression': client.progression,
+                'akitude_url': images.akitude_url(client, _external=True),
+                'preload': images.next_akitude_urls(client, _external=True)
+            })
+        except CantGoBackAnyFurther:
+            return jsonify({'success': False, 'error': "You can't go back any further!"}), 400
+        except UpstreamUnavailable as e:
+            return upstream_unavailable(e)
+        except Exception as e:
+            return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/end', methods=['POST'])
 def end_session():
     data = request.json
     session_id = data.get('session_id')
     
-    if session_id in sessions:
-        del sessions[session_id]
+    sessions.delete(session_id)
     
     return jsonify({'success': True})
 
@@ -1,9 +1,15 @@
 # app.py - Complete Akinator Flask Application
 # Install: pip install flask akinator.py
 
-from flask import Flask, render_template_string, request, session, redirect, url_for
-from akinator import Client
+from flask import Flask, make_response, render_template, request, session, redirect, url_for
+from aki_client import Client
 from akinator.exceptions import CantGoBackAnyFurther
+from page_templates import register_page
+from compression import CompressionMiddleware
+from image_cache import ImageProxy
+from metrics import instrument_app
+from web_assets import AssetPipeline
+from upstream_guard import UpstreamUnavailable
 import secrets
 
 app = Flask(__name__)
@@ -447,10 +453,21 @@ HTML_TEMPLATE = """
 </html>
 """
 
+# Inline CSS and scripts are served as content-hashed, long-cached assets;
+# the page itself is compiled once at startup and reused by every request
+assets = AssetPipeline(app)
+# Pages and assets are compressed once per distinct body and reused from cache
+app.wsgi_app = CompressionMiddleware(app.wsgi_app)
+# Per-route latency and in-flight gauges, served with the upstream metrics at /metrics
+instrument_app(app)
+# Guess photos are proxied through /img/ and cached on local disk
+images = ImageProxy(app)
+PAGE = register_page(app, 'akinator.html', assets.extract(HTML_TEMPLATE, 'akinator'))
+
 @app.route('/')
 def index():
     session.clear()
-    return render_template_string(HTML_TEMPLATE, stage='info')
+    return render_template(PAGE, stage='info')
 
 @app.route('/start', methods=['POST'])
 def start_game():
@@ -467,55 +484,56 @@ def start_game():
         client.start_game(language='en', theme='c')
         
         # Store client state
-        session['question'] = client.question
-        session['step'] = client.step
-        session['progression'] = client.progression
-        session['session_id'] = client.session_id
-        session['signature'] = client.signature
-        session['identifiant'] = client.identifiant
-        session['language'] = client.language
-        session['theme'] = client.theme
-        session['child_mode'] = client.child_mode
+        session['game'] = client.to_state()
         
         return redirect(url_for('game'))
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
-        return render_template_string(HTML_TEMPLATE, stage='info', error=str(e))
+        return render_template(PAGE, stage='info', error=str(e))
 
 @app.route('/game')
 def game():
-    if 'user_info' not in session:
+    if 'user_info' not in session or 'game' not in session:
         return redirect(url_for('index'))
     
-    if session.get('win') and not session.get('finished'):
-        return render_template_string(HTML_TEMPLATE, 
+    client = Client.from_state(session['game'])
+    
+    if client.win and not client.finished:
+        return render_template(PAGE, 
             stage='guess',
             user_info=session['user_info'],
-            guess=session.get('guess', {}),
+            guess={
+                'name': client.name_proposition,
+                'description': client.description_proposition,
+                'photo': images.photo_url(client),
+                'pseudo': client.pseudo
+            },
             error=session.pop('error', None)
         )
     
-    if session.get('finished'):
-        return render_template_string(HTML_TEMPLATE,
+    if client.finished:
+        return render_template(PAGE,
             stage='finished',
-            win=session.get('win', False),
-            name=session.get('name'),
-            description=session.get('description'),
-            photo=session.get('photo'),
-            final_message=session.get('final_message', '')
+            win=client.win,
+            name=client.name_proposition if client.photo else None,
+            description=client.description_proposition if client.photo else None,
+            photo=images.photo_url(client),
+            final_message=client.question or ''
         )
     
-    return render_template_string(HTML_TEMPLATE,
+    return render_template(PAGE,
         stage='game',
         user_info=session['user_info'],
-        question=session.get('question', ''),
-        step=session.get('step', 0),
-        progression=session.get('progression', 0),
+        question=client.question or '',
+        step=client.step or 0,
+        progression=client.progression or 0,
         error=session.pop('error', None)
     )
 
 @app.route('/answer', methods=['POST'])
 def answer():
-    if 'user_info' not in session:
+    if 'user_info' not in session or 'game' not in session:
         return redirect(url_for('index'))
     
     answer_value = request.form['answer']
@@ -525,99 +543,57 @@ def answer():
         return handle_back()
     
     # Recreate client from session
-    client = Client()
-    client.session_id = session['session_id']
-    client.signature = session['signature']
-    client.identifiant = session['identifiant']
-    client.language = session['language']
-    client.theme = session['theme']
-    client.child_mode = session['child_mode']
-    client.question = session['question']
-    client.step = session['step']
-    client.progression = session['progression']
-    client.win = session.get('win', False)
-    client.finished = session.get('finished', False)
-    
-    if session.get('win'):
-        client.id_proposition = session.get('id_proposition', '')
-        client.name_proposition = session.get('name_proposition', '')
-        client.description_proposition = session.get('description_proposition', '')
-        client.photo = session.get('photo', '')
-        client.pseudo = session.get('pseudo', '')
-        client.flag_photo = session.get('flag_photo', '')
-        client.step_last_proposition = session.get('step_last_proposition', 0)
+    client = Client.from_state(session['game'])
     
     try:
         client.answer(answer_value)
+        if client.win:
+            # Start downloading the guess photo before the browser asks for it
+            images.prefetch_photo(client)
         
         # Update session with new state
-        session['question'] = str(client)
-        session['step'] = client.step
-        session['progression'] = client.progression
-        session['finished'] = client.finished
-        session['win'] = client.win
-        
-        # Handle guess
-        if client.win and not client.finished:
-            session['guess'] = {
-                'name': client.name_proposition,
-                'description': client.description_proposition,
-                'photo': client.photo,
-                'pseudo': client.pseudo
-            }
-            session['id_proposition'] = client.id_proposition
-            session['name_proposition'] = client.name_proposition
-            session['description_proposition'] = client.description_proposition
-            session['photo'] = client.photo
-            session['pseudo'] = client.pseudo
-            session['flag_photo'] = client.flag_photo
-            session['step_last_proposition'] = client.step
-        
-        # Handle finished
-        if client.finished:
-            session['final_message'] = client.question
-            if client.photo:
-                session['photo'] = client.photo
-                session['name'] = client.name_proposition
-                session['description'] = client.description_proposition
+        session['game'] = client.to_state()
         
         return redirect(url_for('game'))
         
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         session['error'] = str(e)
         return redirect(url_for('game'))
 
 def handle_back():
     # Recreate client
-    client = Client()
-    client.session_id = session['session_id']
-    client.signature = session['signature']
-    client.identifiant = session['identifiant']
-    client.language = session['language']
-    client.theme = session['theme']
-    client.child_mode = session['child_mode']
-    client.question = session['question']
-    client.step = session['step']
-    client.progression = session['progression']
-    client.win = session.get('win', False)
+    client = Client.from_state(session['game'])
     
     try:
         client.back()
         
         # Update session
-        session['question'] = client.question
-        session['step'] = client.step
-        session['progression'] = client.progression
-        session['win'] = False
-        session.pop('guess', None)
+        session['game'] = client.to_state()
         
         return redirect(url_for('game'))
     except CantGoBackAnyFurther:
         session['error'] = "You can't go back any further!"
         return redirect(url_for('game'))
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         session['error'] = str(e)
         return redirect(url_for('game'))
 
+@app.errorhandler(UpstreamUnavailable)
+def upstream_unavailable(e):
+    # Timed out, circuit open or overloaded: answer quickly with 503 and a retry hint
+    message = 'Akinator is busy right now. Please try again in a moment.'
+    if request.endpoint == 'answer':
+        session['error'] = message
+        response = make_response(game())
+    else:
+        response = make_response(render_template(PAGE, stage='info', error=message))
+    response.status_code = 503
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
\ No newline at end of file
@@ -0,0 +1,52 @@
+# Per-response cost of Cloudflare challenge detection: stock vs. FastCloudflare.
+#
+# Run from the repository root:  python benchmarks/bench_challenge.py
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cloudscraper import create_scraper
+from cloudscraper.cloudflare import Cloudflare
+from requests import Response
+
+from challenges import FastCloudflare
+
+ANSWER = (b'{"completion":"OK","akitude":"serein.png","step":"3","progression":"41.2",'
+          b'"question_id":"112","question":"Is your character a YouTuber?"}')
+START_PAGE = b'<html><head></head><body>' + b'<div class="row">' * 6000 + b'</body></html>'
+BUSY_PAGE = b'<html><body><h1>503 Service Temporarily Unavailable</h1>' + b'<p>nginx</p>' * 4000 + b'</body></html>'
+
+
+def response(status, content_type, body):
+    resp = Response()
+    resp.status_code = status
+    resp.headers['Server'] = 'cloudflare'
+    resp.headers['Content-Type'] = content_type
+    resp._content = body
+    resp.encoding = 'utf-8'
+    return resp
+
+
+CASES = (
+    ('answer JSON 200', response(200, 'application/json', ANSWER)),
+    ('start page 200', response(200, 'text/html; charset=UTF-8', START_PAGE)),
+    ('error page 503', response(503, 'text/html; charset=UTF-8', BUSY_PAGE)),
+)
+
+
+def main(number=20000):
+    scraper = create_scraper()
+    print(f"{'response':<18} {'stock':>10} {'fast':>10}")
+    for name, resp in CASES:
+        timings = []
+        for helper in (Cloudflare, FastCloudflare):
+            check = lambda: helper(scraper).is_Challenge_Request(resp)
+            timings.append(timeit.timeit(check, number=number) / number)
+        print(f"{name:<18} {timings[0] * 1e6:8.2f}us {timings[1] * 1e6:8.2f}us")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+# Cost of one metrics observation on the upstream-call hot path.
+#
+# Run from the repository root:  python benchmarks/bench_metrics.py
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import Counter, Histogram
+
+
+def main(number=500000):
+    histogram = Histogram('bench_seconds', 'Benchmark histogram.', ('operation',))
+    counter = Counter('bench_total', 'Benchmark counter.', ('operation', 'outcome'))
+    baseline = timeit.timeit(lambda: None, number=number)
+    for name, call in (
+        ('histogram.observe', lambda: histogram.observe('answer', value=0.3)),
+        ('counter.inc', lambda: counter.inc('answer', 'ok')),
+    ):
+        elapsed = timeit.timeit(call, number=number) - baseline
+        print(f"{name:<20} {elapsed / number * 1e9:8.0f}ns")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+# Start-page parsing: akinator's response.text + str regexes vs. aki_client's bytes parsing.
+#
+# Run from the repository root:  python benchmarks/bench_parse.py
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import akinator
+from requests import Response
+
+from aki_client import Client
+
+# Roughly the size and shape of a real start page: mostly markup and inline script, some non-ASCII text
+START_PAGE = (
+    '<!DOCTYPE html><html lang="fr"><head><title>Akinator, le génie du web</title></head><body>'
+    + '<div class="row"><p>Pensez à un personnage réel ou fictif. Je vais essayer de deviner qui c\'est.</p></div>' * 700
+    + "<script>$('#session').val('1234567');$('#signature').val('987654321');$('#identifiant').val('555');</script>"
+    + '<div class="bubble-body"><p class="question-text" id="question-label">Votre personnage est-il réel ?</p></div>\n'
+    + '<div class="sub-bubble-propose"><p id="p-sub-bubble">Je pense à</p></div>'
+    + '<script>' + 'var x = "é";' * 2000 + '</script></body></html>'
+).encode('utf-8')
+
+
+class StaticSession:
+    """Answers every request with the same canned response."""
+
+    def __init__(self, content_type):
+        self.content_type = content_type
+
+    def request(self, method, url, **kwargs):
+        response = Response()
+        response.status_code = 200
+        if self.content_type:
+            response.headers['Content-Type'] = self.content_type
+        response._content = START_PAGE
+        return response
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+
+def main(number=50):
+    print(f"start page: {len(START_PAGE) // 1024}KB")
+    for label, content_type in (('charset=UTF-8', 'text/html; charset=UTF-8'), ('no Content-Type', None)):
+        session = StaticSession(content_type)
+        akinator.Client(session).start_game(language='fr')  # compile akinator's patterns outside the loop
+        stock = timeit.timeit(lambda: akinator.Client(session).start_game(language='fr'), number=number) / number
+        ours = timeit.timeit(lambda: Client(session).start_game(language='fr'), number=number) / number
+        print(f"{label:<16} akinator {stock * 1e3:8.3f}ms   bytes {ours * 1e3:8.3f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+# Per-request page render time: render_template_string vs. the precompiled page.
+#
+# Run from the repository root:  python benchmarks/bench_render.py
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import render_template, render_template_string
+
+import Guessing_game
+
+STAGES = {
+    'info': {},
+    'welcome': {'user_info': {'name': 'Asha', 'institution': 'Model School'}},
+    'game': {
+        'user_info': {'name': 'Asha', 'institution': 'Model School'},
+        'question': 'Is your character real?', 'step': 4, 'progression': 42.5,
+    },
+    'finished': {'win': True, 'name': 'Mario', 'description': 'Plumber', 'photo': None, 'final_message': 'Bravo'},
+}
+
+
+def main(number=200):
+    app = Guessing_game.app
+    with app.test_request_context('/'):
+        print(f"{'stage':<10} {'from_string':>12} {'precompiled':>12}")
+        for stage, context in STAGES.items():
+            before = timeit.timeit(
+                lambda: render_template_string(Guessing_game.HTML_TEMPLATE, stage=stage, **context), number=number
+            )
+            after = timeit.timeit(lambda: render_template(Guessing_game.PAGE, stage=stage, **context), number=number)
+            print(f"{stage:<10} {before / number * 1e3:10.3f}ms {after / number * 1e3:10.3f}ms")
+
+
+if __name__ == '__main__':
+    main()
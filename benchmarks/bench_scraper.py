@@ -0,0 +1,43 @@
+# Cost of constructing a CloudScraper: stock, with the cached user-agent
+# catalog, and with shared SSL contexts as well.
+#
+# Run from the repository root:  python benchmarks/bench_scraper.py
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cloudscraper
+from cloudscraper import CipherSuiteAdapter
+from cloudscraper.user_agent import User_Agent
+
+from tls_cache import SharedContextAdapter
+from user_agents import CachedUserAgent, catalog
+
+CONFIGURATIONS = (
+    ('stock', User_Agent, CipherSuiteAdapter),
+    ('cached UA', CachedUserAgent, CipherSuiteAdapter),
+    ('+ shared TLS', CachedUserAgent, SharedContextAdapter),
+)
+
+
+def main(number=200):
+    catalog()  # one-off loads are paid once per process, outside the loop
+    print(f"{'':<18}" + ''.join(f"{label:>14}" for label, _, _ in CONFIGURATIONS))
+    for name, build in (
+        ('User_Agent()', lambda: cloudscraper.User_Agent(allow_brotli=False)),
+        ('create_scraper()', cloudscraper.create_scraper),
+    ):
+        row = f"{name:<18}"
+        for _, user_agent, adapter in CONFIGURATIONS:
+            cloudscraper.User_Agent, cloudscraper.CipherSuiteAdapter = user_agent, adapter
+            build()
+            row += f"{timeit.timeit(build, number=number) / number * 1e3:12.3f}ms"
+        print(row)
+    cloudscraper.User_Agent, cloudscraper.CipherSuiteAdapter = User_Agent, CipherSuiteAdapter
+
+
+if __name__ == '__main__':
+    main()
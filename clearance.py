@@ -0,0 +1,196 @@
+# Cloudflare clearance shared by every scraper in the process.
+#
+# When a scraper gets past a Cloudflare challenge the clearance cookies
+# (cf_clearance and friends) only land in that scraper's cookie jar, so every
+# other pooled scraper, and the async transport, would hit and solve the same
+# challenge again. Here the clearance for each host is kept once per process,
+# together with the User-Agent it was issued to (Cloudflare ties the two),
+# and applied to a scraper before each request. Only one thread solves a
+# host's challenge at a time; the others wait and then reuse its result.
+#
+# Clearance is saved to AKI_CLEARANCE_FILE (by default in the user's cache
+# directory) so it survives restarts, and dropped when its cookies expire (or
+# after AKI_CLEARANCE_TTL seconds when they don't say). The cookies are
+# credentials: the file is only readable by its owner, and a file someone
+# else owns or could have written is ignored.
+
+import json
+import os
+import stat
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import registry
+
+
+def _default_path():
+    cache = os.environ.get('XDG_CACHE_HOME') or os.environ.get('LOCALAPPDATA') or os.path.join(
+        os.path.expanduser('~'), '.cache')
+    return os.path.join(cache, 'aki', 'clearance.json')
+
+
+DEFAULT_PATH = os.environ.get('AKI_CLEARANCE_FILE') or _default_path()
+DEFAULT_TTL = float(os.environ.get('AKI_CLEARANCE_TTL', 1800))
+DEFAULT_SOLVE_WAIT = float(os.environ.get('AKI_CLEARANCE_SOLVE_WAIT', 30))
+
+
+def is_clearance_cookie(name):
+    return name.startswith('cf_') or name.startswith('__cf')
+
+
+def _domain_matches(host, domain):
+    # As in http.cookiejar, a host without dots is 'host.local' for cookie purposes
+    if '.' not in host:
+        host += '.local'
+    domain = domain.lstrip('.')
+    return host == domain or host.endswith('.' + domain)
+
+
+class ClearanceCache:
+    """Per-host Cloudflare clearance cookies and User-Agent, with expiry, single-flight solving and a disk copy."""
+
+    def __init__(self, path=DEFAULT_PATH, ttl=DEFAULT_TTL, solve_wait=DEFAULT_SOLVE_WAIT):
+        self.path = path
+        self.ttl = ttl
+        self.solve_wait = solve_wait
+
+        self._lock = threading.Lock()
+        self._solve_locks = {}
+        self._entries = {}
+        self._versions = 0
+        self.solved = 0
+        self.reused = 0
+        self.applied = 0
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            fd = os.open(self.path, os.O_RDONLY | getattr(os, 'O_NOFOLLOW', 0))
+            with open(fd, encoding='utf-8') as f:
+                info = os.fstat(f.fileno())
+                if hasattr(os, 'getuid') and (info.st_uid != os.getuid() or info.st_mode & (stat.S_IWGRP | stat.S_IWOTH)):
+                    print(f"Ignoring clearance cache {self.path}: not owned by this user, or writable by others")
+                    return
+                stored = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error loading clearance cache: {e}")
+            return
+        now = time.time()
+        for host, entry in stored.items():
+            if entry.get('expires', 0) > now:
+                self._versions += 1
+                self._entries[host] = dict(entry, version=self._versions)
+
+    def _save(self):
+        if not self.path:
+            return
+        stored = {host: {k: v for k, v in entry.items() if k != 'version'} for host, entry in self._entries.items()}
+        try:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+            # mkstemp creates the file exclusively, readable by this user only
+            fd, tmp = tempfile.mkstemp(prefix='.clearance-', suffix='.tmp', dir=directory)
+            try:
+                with open(fd, 'w', encoding='utf-8') as f:
+                    json.dump(stored, f)
+                os.replace(tmp, self.path)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+        except OSError as e:
+            print(f"Error saving clearance cache: {e}")
+
+    def get(self, host):
+        """The unexpired clearance for `host`, or None."""
+        entry = self._entries.get(host)
+        if entry is not None and entry['expires'] <= time.time():
+            with self._lock:
+                if self._entries.get(host) is entry:
+                    del self._entries[host]
+            return None
+        return entry
+
+    def apply(self, scraper, host):
+        """Give `scraper` the current clearance for `host`, unless it already has it."""
+        entry = self.get(host)
+        if entry is None:
+            return False
+        applied = scraper.__dict__.setdefault('_clearance_versions', {})
+        if applied.get(host) == entry['version']:
+            return False
+        for cookie in entry['cookies']:
+            scraper.cookies.set(cookie['name'], cookie['value'], domain=cookie['domain'], path=cookie['path'],
+                                expires=cookie['expires'])
+        if entry['user_agent']:
+            scraper.headers['User-Agent'] = entry['user_agent']
+        applied[host] = entry['version']
+        self.applied += 1
+        return True
+
+    def record(self, scraper, host):
+        """Store the clearance cookies `scraper` now holds for `host`, if any."""
+        cookies = [
+            {'name': c.name, 'value': c.value, 'domain': c.domain, 'path': c.path, 'expires': c.expires}
+            for c in scraper.cookies if is_clearance_cookie(c.name) and _domain_matches(host, c.domain)
+        ]
+        if not cookies:
+            return None
+        now = time.time()
+        expiries = [c['expires'] for c in cookies if c['name'] == 'cf_clearance' and c['expires']]
+        with self._lock:
+            self._versions += 1
+            entry = self._entries[host] = {
+                'cookies': cookies,
+                'user_agent': scraper.headers.get('User-Agent'),
+                'expires': min(expiries) if expiries else now + self.ttl,
+                'version': self._versions,
+            }
+            self.solved += 1
+            self._save()
+        scraper.__dict__.setdefault('_clearance_versions', {})[host] = entry['version']
+        return entry
+
+    @contextmanager
+    def solving(self, host, scraper):
+        """
+        Serialize challenge solving for `host`. Yields True if the caller should
+        solve, or False if another thread got clearance while it waited (apply it
+        and retry instead).
+        """
+        with self._lock:
+            lock = self._solve_locks.setdefault(host, threading.RLock())
+        acquired = lock.acquire(timeout=self.solve_wait)
+        try:
+            entry = self.get(host)
+            if entry is not None and scraper.__dict__.get('_clearance_versions', {}).get(host) != entry['version']:
+                self.reused += 1
+                yield False
+            else:
+                yield True
+        finally:
+            if acquired:
+                lock.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hosts': len(self._entries),
+                'solved': self.solved,
+                'reused': self.reused,
+                'applied': self.applied,
+            }
+
+
+clearances = ClearanceCache()
+
+
+@registry.collector
+def clearance_metrics():
+    stats = clearances.stats()
+    yield 'aki_clearance_hosts', {}, stats['hosts']
+    yield 'aki_clearance_solved', {}, stats['solved']
+    yield 'aki_clearance_reused', {}, stats['reused']
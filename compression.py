@@ -0,0 +1,218 @@
+# Response compression for the Flask apps, as WSGI middleware.
+#
+# Negotiates brotli (when the module is installed) or gzip from
+# Accept-Encoding. Whether a response is compressed is decided from its status
+# and headers; everything else (images, errors, small bodies) streams through
+# unbuffered. Compressed bodies that are the same for every user (no
+# Set-Cookie, no Vary: Cookie) are kept in an LRU keyed by content digest, so
+# static assets and shared pages are only compressed once. Vary: Accept-Encoding is
+# added to whatever the app already varies on (Cookie, for session pages).
+# Totals across middlewares in the process are exposed at /metrics.
+
+import gzip
+import hashlib
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from metrics import registry
+
+COMPRESSIBLE = ('text/', 'application/json', 'application/javascript', 'image/svg+xml')
+DEFAULT_MIN_SIZE = 512
+DEFAULT_CACHE_ENTRIES = 256
+
+
+def negotiate(accept_encoding):
+    """Pick the best supported coding from an Accept-Encoding header, or None."""
+    offered = {}
+    for item in accept_encoding.lower().split(','):
+        coding, _, params = item.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        offered[coding.strip()] = quality
+    if brotli and offered.get('br', 0) > 0:
+        return 'br'
+    if offered.get('gzip', 0) > 0:
+        return 'gzip'
+    return None
+
+
+def add_vary(headers, token='Accept-Encoding'):
+    """`headers` with `token` added to its Vary header, keeping whatever the app already varies on."""
+    existing = [value for name, value in headers if name.lower() == 'vary']
+    tokens = [t.strip() for value in existing for t in value.split(',') if t.strip()]
+    if '*' in tokens or token.lower() in (t.lower() for t in tokens):
+        return headers
+    headers = [(name, value) for name, value in headers if name.lower() != 'vary']
+    headers.append(('Vary', ', '.join(tokens + [token])))
+    return headers
+
+
+_middlewares = weakref.WeakSet()
+
+
+class CompressionMiddleware:
+    """Compresses eligible responses and counts the bytes and CPU time involved."""
+
+    def __init__(self, app, min_size=DEFAULT_MIN_SIZE, level=6, cache_entries=DEFAULT_CACHE_ENTRIES):
+        self.app = app
+        self.min_size = min_size
+        self.level = level
+        self.cache_entries = cache_entries
+
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self.counters = {
+            'responses': 0,
+            'compressed': 0,
+            'cache_hits': 0,
+            'bytes_in': 0,
+            'bytes_out': 0,
+            'cpu_seconds': 0.0,
+        }
+        _middlewares.add(self)
+
+    def __call__(self, environ, start_response):
+        encoding = negotiate(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        if not encoding:
+            def vary(status, headers, exc_info=None):
+                # Shared caches must not hand this identity body to gzip clients, or vice versa
+                if any(name.lower() == 'content-type' and value.startswith(COMPRESSIBLE) for name, value in headers):
+                    headers = add_vary(headers)
+                return start_response(status, headers, exc_info)
+
+            return self.app(environ, vary)
+
+        captured = []
+        chunks = []
+
+        def capture(status, headers, exc_info=None):
+            with self._lock:
+                self.counters['responses'] += 1
+            if not self._eligible(status, headers):
+                # Images, errors, already-encoded bodies: straight through, never buffered
+                captured[:] = [None]
+                return start_response(status, headers, exc_info)
+            captured[:] = [status, headers, exc_info]
+            return chunks.append
+
+        app_iter = self.app(environ, capture)
+        if captured == [None]:
+            return app_iter
+        try:
+            chunks.extend(app_iter)
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+
+        body = b''.join(chunks)
+        if captured == [None]:
+            # start_response only came with the first chunk
+            return [body]
+        status, headers, exc_info = captured
+        if len(body) < self.min_size:
+            start_response(status, headers, exc_info)
+            return [body]
+
+        compressed = self._compress(body, encoding, self._cacheable(headers))
+        headers = [(name, value) for name, value in headers if name.lower() not in ('content-length', 'etag')]
+        headers.append(('Content-Encoding', encoding))
+        headers.append(('Content-Length', str(len(compressed))))
+        headers = add_vary(headers)
+        etag = next((value for name, value in captured[1] if name.lower() == 'etag'), None)
+        if etag:
+            # Same entity, different bytes: keep conditional requests working as a weak match
+            headers.append(('ETag', etag if etag.startswith('W/') else 'W/' + etag))
+        start_response(status, headers, exc_info)
+        return [compressed]
+
+    def _eligible(self, status, headers):
+        if not status.startswith('200'):
+            return False
+        content_type = ''
+        for name, value in headers:
+            lowered = name.lower()
+            if lowered == 'content-encoding':
+                return False
+            if lowered == 'content-type':
+                content_type = value
+            elif lowered == 'content-length' and value.isdigit() and int(value) < self.min_size:
+                return False
+        return content_type.startswith(COMPRESSIBLE)
+
+    @staticmethod
+    def _cacheable(headers):
+        # Only bodies that are the same for everyone (static assets, shared pages) are worth keeping
+        for name, value in headers:
+            lowered = name.lower()
+            if lowered == 'set-cookie':
+                return False
+            if lowered == 'vary' and 'cookie' in value.lower():
+                return False
+            if lowered == 'cache-control' and ('private' in value.lower() or 'no-store' in value.lower()):
+                return False
+        return True
+
+    def _compress(self, body, encoding, cache=True):
+        key = (encoding, hashlib.blake2b(body, digest_size=16).digest()) if cache else None
+        if cache:
+            with self._lock:
+                cached = self._cache.get(key)
+                if cached is not None:
+                    self._cache.move_to_end(key)
+                    self.counters['cache_hits'] += 1
+                    self._count(body, cached, 0.0)
+                    return cached
+
+        started = time.thread_time()
+        if encoding == 'br':
+            compressed = brotli.compress(body, quality=5)
+        else:
+            compressed = gzip.compress(body, compresslevel=self.level, mtime=0)
+        spent = time.thread_time() - started
+
+        with self._lock:
+            if cache:
+                self._cache[key] = compressed
+                if len(self._cache) > self.cache_entries:
+                    self._cache.popitem(last=False)
+            self._count(body, compressed, spent)
+        return compressed
+
+    def _count(self, body, compressed, spent):
+        self.counters['compressed'] += 1
+        self.counters['bytes_in'] += len(body)
+        self.counters['bytes_out'] += len(compressed)
+        self.counters['cpu_seconds'] += spent
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        stats['bytes_saved'] = stats['bytes_in'] - stats['bytes_out']
+        return stats
+
+
+@registry.collector
+def compression_metrics():
+    totals = {}
+    for middleware in list(_middlewares):
+        for key, value in middleware.stats().items():
+            totals[key] = totals.get(key, 0) + value
+    if not totals:
+        return
+    yield 'aki_compression_responses', {}, totals['responses']
+    yield 'aki_compression_compressed', {}, totals['compressed']
+    yield 'aki_compression_cache_hits', {}, totals['cache_hits']
+    yield 'aki_compression_bytes_saved', {}, totals['bytes_saved']
+    yield 'aki_compression_cpu_seconds', {}, totals['cpu_seconds']
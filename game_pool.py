@@ -0,0 +1,206 @@
+# Pool of already-started Akinator games so starting a game doesn't block on
+# the slow upstream /game page.
+#
+# Entries are kept per (language, theme, child_mode) and topped up by
+# background threads. Each key's target size follows the observed start rate
+# (Little's law on the measured start latency), and entries are discarded well
+# before the upstream session would answer "KO - TIMEOUT". Keys are checked
+# against akinator's language and theme maps before they reach the pool, and
+# a failing key backs off on its own without stalling refills for the others.
+# A key nobody has taken a game for in AKI_GAME_POOL_IDLE seconds is retired,
+# so one request in a rare language doesn't keep games starting forever.
+
+import math
+import os
+import threading
+import time
+from collections import deque
+
+from akinator.client import LANG_MAP, THEME_MAP
+from akinator.exceptions import InvalidLanguageError, InvalidThemeError
+
+from aki_client import Client
+from metrics import registry
+
+DEFAULT_MAX_AGE = float(os.environ.get('AKI_GAME_POOL_MAX_AGE', 180))
+DEFAULT_MIN_SIZE = int(os.environ.get('AKI_GAME_POOL_MIN_SIZE', 1))
+DEFAULT_MAX_SIZE = int(os.environ.get('AKI_GAME_POOL_MAX_SIZE', 8))
+DEFAULT_WORKERS = int(os.environ.get('AKI_GAME_POOL_WORKERS', 2))
+DEFAULT_IDLE = float(os.environ.get('AKI_GAME_POOL_IDLE', 900))
+FAILURE_BACKOFF = 5.0
+
+
+def pool_key(language='en', theme='c', child_mode=False):
+    """The normalized (language code, theme, child_mode) key; raises like akinator's start_game for bad values."""
+    code = LANG_MAP.get(language, language) if isinstance(language, str) else None
+    if code not in THEME_MAP:
+        raise InvalidLanguageError(f"Unsupported language: {language}. Supported languages: {', '.join(LANG_MAP.keys())}")
+    if not isinstance(theme, str) or theme not in THEME_MAP[code]:
+        raise InvalidThemeError(f"Theme '{theme}' is not available for language '{language}'.")
+    return code, theme, bool(child_mode)
+
+
+class GamePool:
+    """Keeps N started upstream sessions per (language, theme, child_mode)."""
+
+    def __init__(self, max_age=DEFAULT_MAX_AGE, min_size=DEFAULT_MIN_SIZE, max_size=DEFAULT_MAX_SIZE,
+                 workers=DEFAULT_WORKERS, rate_window=60.0, idle=DEFAULT_IDLE, client_factory=Client):
+        self.max_age = max_age
+        self.min_size = min_size
+        self.max_size = max_size
+        self.workers = workers
+        self.rate_window = rate_window
+        self.idle = idle
+        self.client_factory = client_factory
+
+        self._cond = threading.Condition()
+        self._threads = []
+        self._entries = {}
+        self._pending = {}
+        self._takes = {}
+        self._last_take = {}
+        self._warm = set()
+        self._latency = 2.0
+        self._backoff_until = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.discarded = 0
+        self.failures = 0
+
+    def warm(self, language='en', theme='c', child_mode=False):
+        """Keep games ready for a key before anyone asks for one, and however long nobody does."""
+        key = pool_key(language, theme, child_mode)
+        with self._cond:
+            self._warm.add(key)
+            self._entries.setdefault(key, deque())
+            self._ensure_workers()
+            self._cond.notify_all()
+
+    def take(self, language='en', theme='c', child_mode=False):
+        """Return a started client for the key, or None when none is ready."""
+        key = pool_key(language, theme, child_mode)
+        now = time.monotonic()
+        state = None
+        with self._cond:
+            self._takes.setdefault(key, deque()).append(now)
+            self._last_take[key] = now
+            entries = self._entries.setdefault(key, deque())
+            while entries:
+                started, candidate = entries.popleft()
+                if now - started < self.max_age:
+                    state = candidate
+                    break
+                self.discarded += 1
+            if state:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self._ensure_workers()
+            self._cond.notify_all()
+        return self.client_factory.from_state(state) if state else None
+
+    def start_game(self, language='en', theme='c', child_mode=False):
+        """Return a started client, from the pool when possible, else a cold start."""
+        key = pool_key(language, theme, child_mode)
+        client = self.take(*key)
+        if client is None:
+            # Someone is waiting on this one, so it may be hedged (if enabled for clients)
+            client = self._start(*key, hedge=None)
+        return client
+
+    def stats(self):
+        with self._cond:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'discarded': self.discarded,
+                'failures': self.failures,
+                'start_latency': round(self._latency, 3),
+                'ready': {'/'.join(map(str, key)): len(entries) for key, entries in self._entries.items()},
+            }
+
+    def _start(self, language, theme, child_mode, hedge=False):
+        began = time.monotonic()
+        client = self.client_factory()
+        # Background refills are never hedged: nobody is waiting on them
+        client.start_game(language=language, theme=theme, child_mode=child_mode, hedge=hedge)
+        with self._cond:
+            # Exponentially weighted so the pool follows upstream slowdowns
+            self._latency += 0.2 * (time.monotonic() - began - self._latency)
+        return client
+
+    def _target(self, key, now):
+        takes = self._takes.get(key)
+        while takes and now - takes[0] > self.rate_window:
+            takes.popleft()
+        rate = len(takes) / self.rate_window if takes else 0.0
+        # Enough to cover the demand arriving while a refill is in flight, twice over
+        wanted = math.ceil(rate * self._latency * 2)
+        return max(self.min_size, min(self.max_size, wanted))
+
+    def _next_job(self, now):
+        idle = [key for key in self._entries
+                if key not in self._warm and not self._pending.get(key)
+                and now - self._last_take.get(key, now) >= self.idle]
+        for key in idle:
+            self.discarded += len(self._entries.pop(key))
+            for table in (self._takes, self._last_take, self._backoff_until, self._pending):
+                table.pop(key, None)
+
+        for key, entries in self._entries.items():
+            if now < self._backoff_until.get(key, 0.0):
+                continue
+            while entries and now - entries[0][0] >= self.max_age:
+                entries.popleft()
+                self.discarded += 1
+            if len(entries) + self._pending.get(key, 0) < self._target(key, now):
+                return key
+        return None
+
+    def _ensure_workers(self):
+        if self._threads:
+            return
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'game-pool-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                key = self._next_job(time.monotonic())
+                if key is None:
+                    self._cond.wait(timeout=min(5.0, self.max_age / 4))
+                    continue
+                self._pending[key] = self._pending.get(key, 0) + 1
+
+            started = time.monotonic()
+            try:
+                client = self._start(*key)
+            except Exception:
+                with self._cond:
+                    self.failures += 1
+                    self._backoff_until[key] = time.monotonic() + FAILURE_BACKOFF
+            else:
+                with self._cond:
+                    self._backoff_until.pop(key, None)
+                    self._entries[key].append((started, client.to_state()))
+            finally:
+                with self._cond:
+                    self._pending[key] -= 1
+
+
+game_pool = GamePool()
+
+
+@registry.collector
+def game_pool_metrics():
+    stats = game_pool.stats()
+    yield 'aki_game_pool_hits', {}, stats['hits']
+    yield 'aki_game_pool_misses', {}, stats['misses']
+    yield 'aki_game_pool_discarded', {}, stats['discarded']
+    yield 'aki_game_pool_failures', {}, stats['failures']
+    yield 'aki_game_pool_start_latency_seconds', {}, stats['start_latency']
+    for key, ready in stats['ready'].items():
+        yield 'aki_game_pool_ready', {'key': key}, ready
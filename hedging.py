@@ -0,0 +1,167 @@
+# Hedged requests for idempotent upstream calls.
+#
+# Starting a game has no side effects upstream, so when one attempt is slower
+# than nearly all recent ones a second attempt can be raced against it and
+# the first to finish wins. The hedge delay follows a percentile of recently
+# observed latencies, and a token budget keeps hedges to a small fraction of
+# calls so a slow upstream never sees its load doubled.
+#
+# Only use this for idempotent calls: never for answer, back, exclude or choose.
+# Attempts run on executor threads in a copy of the caller's context, so
+# tracing spans and other contextvars follow them.
+
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FuturesTimeout
+
+DEFAULT_PERCENTILE = float(os.environ.get('AKI_HEDGE_PERCENTILE', 95))
+DEFAULT_BUDGET = float(os.environ.get('AKI_HEDGE_BUDGET', 0.1))
+DEFAULT_INITIAL_DELAY = 2.0
+MIN_DELAY = 0.05
+MIN_SAMPLES = 20
+SAMPLES = 256
+BURST = 10.0
+# Attempts enforce the deadline themselves; this only catches one that doesn't
+DEADLINE_GRACE = 0.5
+
+
+class Hedger:
+    """Races a second attempt when the first is slower than the `percentile` of recent calls."""
+
+    def __init__(self, percentile=DEFAULT_PERCENTILE, budget=DEFAULT_BUDGET, workers=32):
+        self.percentile = percentile
+        self.budget = budget
+
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=SAMPLES)
+        self._tokens = BURST
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='hedge')
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.denied = 0
+
+    def observe(self, latency):
+        """Record the latency of one completed attempt."""
+        with self._lock:
+            self._samples.append(latency)
+
+    def delay(self):
+        """Current hedge delay: the configured percentile of recent latencies."""
+        with self._lock:
+            if len(self._samples) < MIN_SAMPLES:
+                return DEFAULT_INITIAL_DELAY
+            ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+        return max(MIN_DELAY, ordered[index])
+
+    def _admit(self):
+        # Every call earns `budget` of a token; a hedge spends a whole one
+        with self._lock:
+            self.calls += 1
+            self._tokens = min(BURST, self._tokens + self.budget)
+
+    def _spend(self):
+        with self._lock:
+            if self._tokens < 1:
+                self.denied += 1
+                return False
+            self._tokens -= 1
+            self.hedged += 1
+            return True
+
+    def _timed(self, attempt):
+        started = time.monotonic()
+        result = attempt()
+        self.observe(time.monotonic() - started)
+        return result
+
+    def _submit(self, attempt):
+        return self._executor.submit(contextvars.copy_context().run, self._timed, attempt)
+
+    def run(self, attempt, deadline=None):
+        """
+        Call `attempt()` (possibly twice, concurrently) and return the first
+        successful result. Raises TimeoutError if none has finished `deadline` seconds in.
+        """
+        self._admit()
+        deadline_at = None if deadline is None else time.monotonic() + deadline + DEADLINE_GRACE
+
+        def remaining():
+            return None if deadline_at is None else max(0.0, deadline_at - time.monotonic())
+
+        primary = self._submit(attempt)
+        delay = self.delay() if deadline_at is None else min(self.delay(), remaining())
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._spend():
+            try:
+                return primary.result(timeout=remaining())
+            except FuturesTimeout:
+                raise TimeoutError("No attempt finished before the deadline.") from None
+
+        hedge = self._submit(attempt)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=remaining(), return_when=FIRST_COMPLETED)
+            if not done:
+                raise TimeoutError("No attempt finished before the deadline.")
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    # The loser finishes in the background and is dropped
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    async def run_async(self, attempt):
+        """`run` for coroutine functions; the losing attempt is cancelled."""
+        self._admit()
+        primary = asyncio.ensure_future(self._timed_async(attempt))
+        done, _ = await asyncio.wait([primary], timeout=self.delay())
+        if done or not self._spend():
+            return await primary
+
+        hedge = asyncio.ensure_future(self._timed_async(attempt))
+        pending = {primary, hedge}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            with self._lock:
+                                self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _timed_async(self, attempt):
+        started = time.monotonic()
+        result = await attempt()
+        self.observe(time.monotonic() - started)
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'hedged': self.hedged,
+                'hedge_wins': self.hedge_wins,
+                'denied': self.denied,
+                'samples': len(self._samples),
+            }
+
+
+start_hedger = Hedger()
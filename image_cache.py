@@ -0,0 +1,405 @@
+# Local proxy for character photos and akitude images.
+#
+# Pages link to /img/<key> instead of the upstream CDN. Keys are derived from
+# a digest of the photo URL ("photo-<digest>", which still works once the game
+# is over) or the akitude file name ("akitude-<name>"), and the bytes live in
+# a size-bounded LRU directory shared by every worker process. That directory
+# is private to the user running the app (0700, in its cache directory by
+# default), and only URLs on AKI_IMAGE_HOSTS are ever fetched. Photos are
+# fetched in the background as soon as a guess is produced, so by the time the
+# browser asks for one it is usually already on disk. Upstream URLs that fail are remembered for a while
+# instead of being retried on every page view.
+#
+# The akitudes (Akinator's mood pictures) are a small fixed set, so they are
+# loaded once at startup, kept in memory and linked with a content version,
+# which makes them immutable for browsers. Responses also name the akitudes
+# most likely to come next so the front end can warm them ahead of time.
+
+import hashlib
+import os
+import re
+import stat
+import tempfile
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from flask import Response, abort, make_response, request, send_file, url_for
+
+from aki_transport import shared_session
+from metrics import registry
+
+CACHE_DIR = os.environ.get('AKI_IMAGE_CACHE') or os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.environ.get('LOCALAPPDATA') or os.path.join(os.path.expanduser('~'), '.cache'),
+    'aki', 'images')
+# Akinator itself (akitudes) and its photo CDN
+UPSTREAM_HOSTS = tuple(os.environ.get('AKI_IMAGE_HOSTS', 'akinator.com,clarinea.fr').split(','))
+DEFAULT_MAX_BYTES = int(os.environ.get('AKI_IMAGE_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+DEFAULT_NEGATIVE_TTL = float(os.environ.get('AKI_IMAGE_NEGATIVE_TTL', 3600))
+MAX_AGE = 30 * 24 * 3600
+FETCH_TIMEOUT = 10
+NEGATIVE_ENTRIES = 10000
+AKITUDE_URL = 'https://{language}.akinator.com/assets/img/akitudes_670x1096/{name}'
+# Roughly in mood order, from the opening challenge to the final reveal
+AKITUDES = tuple(os.environ.get('AKI_AKITUDES', ','.join((
+    'defi.png', 'serein.png', 'inspiration_legere.png', 'inspiration_forte.png', 'confiant.png',
+    'mobile.png', 'leger_decouragement.png', 'vrai_decouragement.png', 'surprise.png',
+    'triomphe.png', 'deception.png',
+))).split(','))
+
+KEY_RE = re.compile(r'^[A-Za-z0-9_.-]{1,128}$')
+SIDECAR_SUFFIXES = ('.url', '.tmp')
+SIGNATURES = (
+    (b'\x89PNG', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF8', 'image/gif'),
+    (b'RIFF', 'image/webp'),
+)
+
+
+_proxies = weakref.WeakSet()
+
+
+def sniff(data):
+    """The image mimetype for `data`, or None if it is not an image we serve."""
+    for magic, mimetype in SIGNATURES:
+        if data.startswith(magic):
+            return mimetype
+    return None
+
+
+def valid_key(key):
+    """Whether `key` names a cached image (and not a URL sidecar or a partial download)."""
+    return bool(KEY_RE.match(key)) and not key.endswith(SIDECAR_SUFFIXES)
+
+
+def allowed_url(url):
+    """Whether `url` is an http(s) URL on one of UPSTREAM_HOSTS (or a subdomain)."""
+    parts = urlsplit(url)
+    host = (parts.hostname or '').lower()
+    return parts.scheme in ('http', 'https') and any(
+        host == allowed or host.endswith('.' + allowed) for allowed in UPSTREAM_HOSTS)
+
+
+def private_directory(path):
+    """`path`, created 0700, or a fresh private temporary directory if someone else owns or can write to it."""
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if stat.S_ISDIR(info.st_mode) and not (hasattr(os, 'getuid') and (
+            info.st_uid != os.getuid() or info.st_mode & (stat.S_IWGRP | stat.S_IWOTH))):
+        return path
+    print(f"Not using image cache {path}: not a directory owned by this user, or writable by others")
+    return tempfile.mkdtemp(prefix='aki-image-cache-')
+
+
+def photo_key(url):
+    return 'photo-' + hashlib.sha256(url.encode('utf-8')).hexdigest()[:32]
+
+
+class ImageProxy:
+    """Serves upstream images under /img/<key> from an LRU disk cache."""
+
+    def __init__(self, app, directory=CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, negative_ttl=DEFAULT_NEGATIVE_TTL,
+                 session=shared_session, url_prefix='/img', workers=2):
+        self.directory = private_directory(directory)
+        self.max_bytes = max_bytes
+        self.negative_ttl = negative_ttl
+        self.session = session
+
+        self._lock = threading.Lock()
+        self._files = OrderedDict()
+        self._bytes = 0
+        self._urls = {}
+        self._dead = OrderedDict()
+        self._inflight = {}
+        self._pinned = {}
+        self._pinning = set()
+        self._transitions = {}
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image-prefetch')
+        self.counters = {'hits': 0, 'misses': 0, 'fetches': 0, 'failures': 0, 'negative_hits': 0, 'evictions': 0}
+        self._load()
+        _proxies.add(self)
+
+        app.add_url_rule(f'{url_prefix}/<key>', 'image', self.serve)
+
+    def _load(self):
+        # Pick up what earlier runs (or other workers) left behind, oldest first
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if valid_key(name) and os.path.isfile(path):
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._files[name] = size
+            self._bytes += size
+        self._evict()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def register(self, key, url):
+        """Map `key` to its upstream `url`; recorded on disk so any worker can serve it."""
+        if self._urls.get(key) == url:
+            return
+        self._urls[key] = url
+        with open(self._path(key) + '.url', 'w', encoding='utf-8') as f:
+            f.write(url)
+
+    def _upstream(self, key):
+        url = self._urls.get(key)
+        if url is None:
+            try:
+                with open(self._path(key) + '.url', encoding='utf-8') as f:
+                    url = self._urls[key] = f.read().strip()
+            except OSError:
+                pass
+        if url is None and key.startswith('akitude-') and key[len('akitude-'):] in AKITUDES:
+            url = AKITUDE_URL.format(language='en', name=key[len('akitude-'):])
+        if url is not None and not allowed_url(url):
+            print(f"Not fetching image {url}: host not in AKI_IMAGE_HOSTS")
+            return None
+        return url
+
+    def prefetch_photo(self, client):
+        """Start fetching the client's guess photo; returns its key, or None if it can't be proxied."""
+        if not client.photo or not allowed_url(client.photo):
+            return None
+        key = photo_key(client.photo)
+        self.register(key, client.photo)
+        self.prefetch(key)
+        return key
+
+    def photo_url(self, client, **kwargs):
+        """Local URL for the client's current guess photo; None without a photo."""
+        key = self.prefetch_photo(client)
+        if key is None:
+            return client.photo
+        return url_for('image', key=key, **kwargs)
+
+    def akitude_url(self, client, **kwargs):
+        """Local URL for the client's current akitude image, versioned once it is loaded."""
+        if not client.akitude:
+            return client.akitude_url
+        key = f'akitude-{client.akitude}'
+        if not valid_key(key):
+            return client.akitude_url
+        pinned = self._pinned.get(key)
+        if pinned:
+            return url_for('image', key=key, v=pinned[2], **kwargs)
+        # One we didn't know about: fetch it into the disk cache; serve() keeps it in memory from then on
+        self.register(key, client.akitude_url)
+        self.prefetch(key)
+        return url_for('image', key=key, **kwargs)
+
+    def preload_akitudes(self, names=AKITUDES, background=True):
+        """Load the akitude images into memory, from the disk cache or upstream."""
+        with self._lock:
+            keys = [f'akitude-{name}' for name in names if f'akitude-{name}' not in self._pinning]
+            self._pinning.update(keys)
+        if not keys:
+            return
+        if background:
+            threading.Thread(target=self._pin, args=(keys,), name='akitude-preload', daemon=True).start()
+        else:
+            self._pin(keys)
+
+    def _pin(self, keys):
+        for key in keys:
+            try:
+                found = self.get(key)
+            except RuntimeError:
+                # The interpreter is shutting down and the fetch executor with it
+                return
+            if found is None:
+                with self._lock:
+                    # Allow another attempt once the negative entry expires
+                    self._pinning.discard(key)
+                continue
+            self._pin_file(key, *found)
+
+    def _pin_file(self, key, path, mimetype):
+        with open(path, 'rb') as f:
+            data = f.read()
+        pinned = self._pinned[key] = (data, mimetype, hashlib.sha256(data).hexdigest()[:12])
+        return pinned
+
+    def observe(self, previous, current):
+        """Record an akitude change between two steps of a game."""
+        if previous and current and previous != current:
+            with self._lock:
+                seen = self._transitions.setdefault(previous, {})
+                seen[current] = seen.get(current, 0) + 1
+
+    def next_akitude_urls(self, client, limit=2, **kwargs):
+        """Versioned URLs of the akitudes most likely to follow the current one, for preloading."""
+        current = client.akitude
+        with self._lock:
+            seen = dict(self._transitions.get(current, {}))
+        likely = sorted(seen, key=seen.get, reverse=True)
+        if current in AKITUDES:
+            # Until there is history, guess the neighbouring moods
+            index = AKITUDES.index(current)
+            likely += AKITUDES[index + 1:index + 2] + AKITUDES[max(index - 1, 0):index]
+        urls = []
+        for name in likely:
+            pinned = self._pinned.get(f'akitude-{name}')
+            if pinned and name != current:
+                url = url_for('image', key=f'akitude-{name}', v=pinned[2], **kwargs)
+                if url not in urls:
+                    urls.append(url)
+            if len(urls) >= limit:
+                break
+        return urls
+
+    def prefetch(self, key):
+        """Start fetching `key` in the background unless it is cached, dead or already in flight."""
+        with self._lock:
+            if key in self._files or key in self._inflight or self._is_dead(key):
+                return
+            self._inflight[key] = self._executor.submit(self._fetch, key)
+
+    def get(self, key):
+        """Path and mimetype of the cached image for `key`, fetching it if needed; None if unavailable."""
+        if not valid_key(key):
+            return None
+        with self._lock:
+            if key in self._files:
+                self._files.move_to_end(key)
+                self.counters['hits'] += 1
+                future = None
+            elif self._is_dead(key):
+                self.counters['negative_hits'] += 1
+                return None
+            else:
+                self.counters['misses'] += 1
+                future = self._inflight.get(key)
+                if future is None:
+                    future = self._inflight[key] = self._executor.submit(self._fetch, key)
+        if future is not None and not future.result():
+            return None
+
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                mimetype = sniff(f.read(12))
+        except OSError:
+            with self._lock:
+                self._forget(key)
+            return None
+        return path, mimetype
+
+    def _fetch(self, key):
+        try:
+            path = self._path(key)
+            if os.path.exists(path):
+                # Another worker already has it
+                ok = True
+            else:
+                ok = self._download(key, path)
+            with self._lock:
+                if ok:
+                    if key not in self._files:
+                        size = os.path.getsize(path)
+                        self._files[key] = size
+                        self._bytes += size
+                    self._evict()
+                else:
+                    self._dead[key] = time.monotonic() + self.negative_ttl
+                    if len(self._dead) > NEGATIVE_ENTRIES:
+                        self._dead.popitem(last=False)
+            return ok
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _download(self, key, path):
+        url = self._upstream(key)
+        if not url:
+            return False
+        with self._lock:
+            self.counters['fetches'] += 1
+        try:
+            response = self.session.get(url, timeout=FETCH_TIMEOUT)
+            data = response.content if response.status_code == 200 else b''
+        except Exception as e:
+            print(f"Error fetching image {url}: {e}")
+            data = b''
+        if not sniff(data):
+            with self._lock:
+                self.counters['failures'] += 1
+            return False
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        return True
+
+    def _is_dead(self, key):
+        expires = self._dead.get(key)
+        if expires is None:
+            return False
+        if expires > time.monotonic():
+            return True
+        del self._dead[key]
+        return False
+
+    def _forget(self, key):
+        size = self._files.pop(key, None)
+        if size is not None:
+            self._bytes -= size
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and len(self._files) > 1:
+            key, size = self._files.popitem(last=False)
+            self._bytes -= size
+            self.counters['evictions'] += 1
+            for path in (self._path(key), self._path(key) + '.url'):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def serve(self, key):
+        if not valid_key(key):
+            abort(404)
+        pinned = self._pinned.get(key)
+        if pinned is None:
+            found = self.get(key)
+            if found is None:
+                # Dead upstream image: let browsers and proxies remember that too
+                response = make_response('', 404)
+                response.headers['Cache-Control'] = f'public, max-age={int(self.negative_ttl)}'
+                return response
+            if key.startswith('akitude-'):
+                # An akitude outside the preloaded set: keep it in memory like the others
+                pinned = self._pin_file(key, *found)
+        if pinned:
+            data, mimetype, version = pinned
+            response = Response(data, mimetype=mimetype)
+            response.set_etag(version)
+            if request.args.get('v') == version:
+                response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+            else:
+                response.headers['Cache-Control'] = f'public, max-age={MAX_AGE}'
+            return response.make_conditional(request)
+        path, mimetype = found
+        return send_file(path, mimetype=mimetype, max_age=MAX_AGE, conditional=True)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, entries=len(self._files), bytes=self._bytes, dead=len(self._dead),
+                        akitudes=len(self._pinned))
+
+
+@registry.collector
+def image_cache_metrics():
+    for proxy in list(_proxies):
+        stats = proxy.stats()
+        for name in ('hits', 'misses', 'fetches', 'failures', 'negative_hits', 'evictions'):
+            yield f'aki_image_cache_{name}', {}, stats[name]
+        yield 'aki_image_cache_entries', {}, stats['entries']
+        yield 'aki_image_cache_bytes', {}, stats['bytes']
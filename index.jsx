@@ -3,6 +3,14 @@ import { Brain, User, Phone, Building2, ArrowLeft, Sparkles, AlertCircle } from
 
 const API_BASE = 'http://localhost:5000/api';
 
+// Warm the browser cache with the akitudes the server expects to show next
+const preloadImages = (urls) => {
+  (urls || []).forEach((url) => {
+    const img = new Image();
+    img.src = url;
+  });
+};
+
 const AkinatorGame = () => {
   const [stage, setStage] = useState('info');
   const [userInfo, setUserInfo] = useState({ name: '', phone: '', institution: '' });
@@ -46,6 +54,7 @@ const AkinatorGame = () => {
       const data = await response.json();
       
       if (data.success) {
+        preloadImages(data.preload);
         setSessionId(data.session_id);
         setGameState({
           question: data.question,
@@ -67,6 +76,21 @@ const AkinatorGame = () => {
     }
   };
 
+  const handleExpired = () => {
+    // The server dropped this game (idle too long); keep the player's details so they can restart
+    setStage('info');
+    setSessionId(null);
+    setGameState({
+      question: '',
+      step: 0,
+      progression: 0,
+      finished: false,
+      win: false,
+      guess: null
+    });
+    setError('Your game expired. Please start again.');
+  };
+
   const sendAnswer = async (answer) => {
     setLoading(true);
     setError(null);
@@ -81,6 +105,7 @@ const AkinatorGame = () => {
       const data = await response.json();
       
       if (data.success) {
+        preloadImages(data.preload);
         setGameState({
           question: data.question,
           step: data.step,
@@ -94,6 +119,8 @@ const AkinatorGame = () => {
           description: data.description || null,
           akitudeUrl: data.akitude_url
         });
+      } else if (data.expired) {
+        handleExpired();
       } else {
         setError(data.error || 'Failed to submit answer');
       }
@@ -118,6 +145,7 @@ const AkinatorGame = () => {
       const data = await response.json();
       
       if (data.success) {
+        preloadImages(data.preload);
         setGameState(prev => ({
           ...prev,
           question: data.question,
@@ -127,6 +155,8 @@ const AkinatorGame = () => {
           guess: null,
           akitudeUrl: data.akitude_url
         }));
+      } else if (data.expired) {
+        handleExpired();
       } else {
         setError(data.error || "Can't go back any further!");
       }
@@ -0,0 +1,220 @@
+# In-process metrics in the Prometheus text format.
+#
+# Histograms are fixed bucket arrays: an observation is one bisect and a few
+# integer increments under an uncontended per-series lock, under a
+# microsecond. instrument_app() adds per-route latency and in-flight gauges
+# to a Flask app and serves everything registered here at /metrics.
+#
+# Values are per process; with several workers, scrape each one.
+
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, g, request
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            series = sorted(self._series.items())
+        for values, value in series:
+            lines += self._render_series(values, value)
+        return lines
+
+    def _render_series(self, values, value):
+        return [f'{self.name}{_labels(self.labelnames, values)} {_number(value[0])}']
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        self._lock.acquire()
+        cell = self._series.get(labels)
+        if cell is None:
+            cell = self._series[labels] = [0]
+        cell[0] += amount
+        self._lock.release()
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def inc(self, *labels, amount=1):
+        self._lock.acquire()
+        cell = self._series.get(labels)
+        if cell is None:
+            cell = self._series[labels] = [0]
+        cell[0] += amount
+        self._lock.release()
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value):
+        with self._lock:
+            self._series[labels] = [value]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, *labels, value):
+        index = bisect_left(self.buckets, value)
+        series = self._series.get(labels)
+        if series is None:
+            with self._lock:
+                # [per-bucket counts (+Inf last), sum, lock]
+                series = self._series.setdefault(labels, [[0] * (len(self.buckets) + 1), 0.0, threading.Lock()])
+        lock = series[2]
+        # Explicit acquire/release: measurably cheaper than a with-block on this hot path
+        lock.acquire()
+        series[0][index] += 1
+        series[1] += value
+        lock.release()
+
+    def _render_series(self, values, series):
+        counts, total, lock = series
+        with lock:
+            counts = list(counts)
+            total = series[1]
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{_labels(self.labelnames, values, [("le", _number(bound))])} {cumulative}')
+        lines.append(f'{self.name}_sum{_labels(self.labelnames, values)} {_number(total)}')
+        lines.append(f'{self.name}_count{_labels(self.labelnames, values)} {cumulative}')
+        return lines
+
+
+class Registry:
+    """Everything /metrics exposes, plus callbacks that turn other modules' stats() into gauges."""
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._add(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._add(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, documentation, labelnames, buckets))
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, func):
+        """Register `func()` -> iterable of (name, labels dict, value), read as gauges at scrape time."""
+        self.collectors.append(func)
+        return func
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        for func in self.collectors:
+            try:
+                for name, labels, value in func():
+                    lines.append(f'{name}{_labels(labels.keys(), labels.values())} {_number(value)}')
+            except Exception as e:
+                lines.append(f'# collector {func.__name__} failed: {_escape(e)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+# Upstream Akinator calls, recorded by aki_client
+upstream_latency = registry.histogram(
+    'aki_upstream_call_seconds', 'Latency of Akinator client calls.', ('operation',))
+upstream_calls = registry.counter(
+    'aki_upstream_calls_total', 'Akinator client calls by outcome (ok, error, timeout, unavailable).',
+    ('operation', 'outcome'))
+upstream_response_bytes = registry.histogram(
+    'aki_upstream_response_bytes', 'Size of Akinator response bodies.', ('operation',), SIZE_BUCKETS)
+upstream_challenges = registry.counter(
+    'aki_upstream_challenges_total', 'Responses that were, or went through, a Cloudflare challenge.', ('operation',))
+upstream_timeouts = registry.counter(
+    'aki_upstream_timeouts_total', 'Client calls that ran out of time.', ('operation',))
+upstream_ko_timeouts = registry.counter(
+    'aki_upstream_ko_timeout_total', "Responses with completion 'KO - TIMEOUT' (game expired upstream).", ('operation',))
+
+# Cloudflare challenge detection on every scraper response, recorded by challenges
+challenge_checks = registry.counter(
+    'aki_challenge_checks_total', 'Responses checked for a Cloudflare challenge, by path (fast or body).', ('path',))
+challenge_check_seconds = registry.counter(
+    'aki_challenge_check_seconds_total', 'Time spent checking responses for a Cloudflare challenge.', ('path',))
+
+# Flask routes, recorded by instrument_app
+route_latency = registry.histogram(
+    'aki_http_request_seconds', 'Latency of HTTP requests by route.', ('app', 'route', 'status'))
+route_in_flight = registry.gauge(
+    'aki_http_requests_in_flight', 'HTTP requests currently being handled.', ('app', 'route'))
+
+
+def instrument_app(app, name=None):
+    """Record per-route latency and in-flight requests for `app`, and serve /metrics."""
+    name = name or app.import_name
+
+    @app.before_request
+    def _start_timer():
+        g._metrics_route = request.url_rule.rule if request.url_rule else 'unmatched'
+        g._metrics_started = time.perf_counter()
+        route_in_flight.inc(name, g._metrics_route)
+
+    @app.after_request
+    def _record(response):
+        started = g.pop('_metrics_started', None)
+        if started is not None:
+            route_latency.observe(name, g._metrics_route, response.status_code, value=time.perf_counter() - started)
+        return response
+
+    @app.teardown_request
+    def _done(exc):
+        route = g.pop('_metrics_route', None)
+        if route is not None:
+            route_in_flight.dec(name, route)
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(registry.render(), content_type=CONTENT_TYPE)
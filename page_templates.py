@@ -0,0 +1,51 @@
+# Compile-once loading for the apps' inline page templates.
+#
+# render_template_string goes through Environment.from_string, which parses
+# and compiles the whole page (CSS, scripts and every stage branch) on every
+# request. Registering the source under a template name instead lets Flask's
+# render_template reuse the compiled Template from the environment cache, and
+# a bytecode cache on disk lets fresh worker processes skip compilation too.
+#
+# Cached bytecode is executed as is, so the cache directory must be private:
+# by default it is Jinja's own per-user directory, which Jinja creates 0700
+# and checks ownership of. An AKI_TEMPLATE_CACHE directory gets the same
+# treatment here, and is not used if someone else owns or can write to it.
+
+import os
+import stat
+
+from jinja2 import ChoiceLoader, DictLoader, FileSystemBytecodeCache
+
+CACHE_DIR = os.environ.get('AKI_TEMPLATE_CACHE')
+
+
+def _bytecode_cache(cache_dir):
+    if not cache_dir:
+        return FileSystemBytecodeCache()
+    os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+    info = os.lstat(cache_dir)
+    if not stat.S_ISDIR(info.st_mode) or (hasattr(os, 'getuid') and (
+            info.st_uid != os.getuid() or info.st_mode & (stat.S_IWGRP | stat.S_IWOTH))):
+        print(f"Not caching template bytecode in {cache_dir}: not a directory owned by this user, or writable by others")
+        return None
+    return FileSystemBytecodeCache(cache_dir)
+
+
+def register_page(app, name, source, cache_dir=CACHE_DIR):
+    """
+    Make `source` available to `render_template(name, ...)` and compile it now.
+
+    `name` should end in ``.html`` so Flask keeps autoescaping on, as it did
+    for render_template_string.
+    """
+    pages = getattr(app, 'inline_pages', None)
+    if pages is None:
+        pages = app.inline_pages = {}
+        app.jinja_loader = ChoiceLoader([loader for loader in (DictLoader(pages), app.jinja_loader) if loader])
+    pages[name] = source
+
+    if app.jinja_env.bytecode_cache is None:
+        app.jinja_env.bytecode_cache = _bytecode_cache(cache_dir)
+
+    app.jinja_env.get_template(name)
+    return name
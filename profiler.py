@@ -0,0 +1,118 @@
+# On-demand sampling profiler for a live process.
+#
+# GET /debug/profile?seconds=N samples every thread's Python stack through
+# sys._current_frames() for N seconds and returns them in the collapsed-stack
+# format that flamegraph.pl, speedscope and inferno read ("a;b;c 42" per
+# line, root frame first). Nothing runs between profiles, so the idle cost is
+# zero; while one runs, the requesting worker thread does the sampling and
+# everything else keeps serving.
+#
+# The endpoint only exists when AKI_ADMIN_TOKEN is set, and requires that
+# token as "Authorization: Bearer <token>" (or ?token=).
+
+import hmac
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import Response, abort, request
+
+ADMIN_TOKEN = os.environ.get('AKI_ADMIN_TOKEN', '')
+DEFAULT_RATE = float(os.environ.get('AKI_PROFILE_HZ', 100))
+MAX_RATE = 1000.0
+MAX_SECONDS = 120.0
+
+
+class SamplingProfiler:
+    """Samples all threads' stacks at a fixed rate; one profile at a time per process."""
+
+    def __init__(self, rate=DEFAULT_RATE):
+        self.rate = rate
+        self._busy = threading.Lock()
+        self._labels = {}
+
+    def _label(self, code, lineno):
+        key = (code, lineno)
+        label = self._labels.get(key)
+        if label is None:
+            label = self._labels[key] = f'{code.co_name} ({os.path.basename(code.co_filename)}:{lineno})'
+        return label
+
+    def profile(self, seconds, rate=None, by_thread=False):
+        """
+        Sample for `seconds` and return a Counter of collapsed stacks, or None if
+        another profile is already running.
+        """
+        if not self._busy.acquire(blocking=False):
+            return None
+        try:
+            interval = 1.0 / min(rate or self.rate, MAX_RATE)
+            me = threading.get_ident()
+            stacks = Counter()
+            deadline = time.perf_counter() + seconds
+            next_at = time.perf_counter()
+            while next_at < deadline:
+                names = {thread.ident: thread.name for thread in threading.enumerate()} if by_thread else None
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    frames = []
+                    while frame is not None:
+                        frames.append(self._label(frame.f_code, frame.f_lineno))
+                        frame = frame.f_back
+                    if by_thread:
+                        frames.append(names.get(ident, str(ident)))
+                    stacks[';'.join(reversed(frames))] += 1
+                next_at += interval
+                pause = next_at - time.perf_counter()
+                if pause > 0:
+                    time.sleep(pause)
+                else:
+                    # Fell behind (slow sample or GIL contention): skip missed ticks
+                    next_at = time.perf_counter()
+            return stacks
+        finally:
+            self._busy.release()
+
+
+def collapse(stacks):
+    """Render a Counter of stacks in the collapsed format, most frequent first."""
+    return ''.join(f'{stack} {count}\n' for stack, count in stacks.most_common())
+
+
+profiler = SamplingProfiler()
+
+
+def _authorized(token):
+    supplied = request.headers.get('Authorization', '')
+    if supplied.startswith('Bearer '):
+        supplied = supplied[len('Bearer '):]
+    else:
+        supplied = request.args.get('token', '')
+    return hmac.compare_digest(supplied.encode(), token.encode())
+
+
+def register_profiler(app, token=ADMIN_TOKEN):
+    """Serve /debug/profile on `app` if an admin token is configured."""
+    if not token:
+        return
+
+    @app.route('/debug/profile')
+    def debug_profile():
+        if not _authorized(token):
+            abort(403)
+        try:
+            seconds = min(float(request.args.get('seconds', 10)), MAX_SECONDS)
+            rate = float(request.args['hz']) if 'hz' in request.args else None
+        except ValueError:
+            abort(400)
+        if seconds <= 0 or (rate is not None and rate <= 0):
+            abort(400)
+        stacks = profiler.profile(seconds, rate, by_thread=request.args.get('threads') == '1')
+        if stacks is None:
+            return Response("A profile is already running.\n", status=409, content_type='text/plain')
+        response = Response(collapse(stacks), content_type='text/plain; charset=utf-8')
+        response.headers['Cache-Control'] = 'no-store'
+        return response
@@ -0,0 +1,298 @@
+# Append-only log of player registrations.
+#
+# Requests only enqueue a record; a background thread writes whatever has
+# queued up as one batch of JSON lines, fsyncs once per batch and rotates the
+# file by size. An exclusive lock on a sidecar file keeps several worker
+# processes from interleaving batches or rotating under each other.
+#
+# Optionally, each batch is also inserted into an indexed SQLite registry
+# (set AKI_REGISTRY_DB) for repeat-player lookups, per-institution counts and
+# streaming exports.
+
+import atexit
+import json
+import os
+import queue
+import sqlite3
+import sys
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+DEFAULT_MAX_BYTES = int(os.environ.get('AKI_REGISTRATION_LOG_MAX_BYTES', 50 * 1024 * 1024))
+DEFAULT_BACKUPS = 10
+BATCH_SIZE = 500
+
+
+def salvage_records(text):
+    """
+    The registration records in a JSON array file, or as many as can still be
+    decoded when it is truncated or corrupted. Returns (records, skipped).
+    """
+    try:
+        data = json.loads(text)
+    except ValueError:
+        data = None
+    if isinstance(data, list):
+        records = [record for record in data if isinstance(record, dict)]
+        return records, len(data) - len(records)
+
+    # Recover every object that still decodes, e.g. all but the last of a file cut off mid-write
+    decoder = json.JSONDecoder()
+    records, skipped = [], 0
+    index = text.find('{')
+    while index != -1:
+        try:
+            record, end = decoder.raw_decode(text, index)
+        except ValueError:
+            skipped += 1
+            index = text.find('{', index + 1)
+            continue
+        if isinstance(record, dict):
+            records.append(record)
+        index = text.find('{', end)
+    return records, skipped
+
+
+class FileLock:
+    """Exclusive inter-process lock on `path`."""
+
+    def __init__(self, path):
+        self.path = path
+        self._handle = None
+
+    def __enter__(self):
+        self._handle = open(self.path, 'a+')
+        if fcntl:
+            fcntl.flock(self._handle, fcntl.LOCK_EX)
+        else:
+            self._handle.seek(0)
+            msvcrt.locking(self._handle.fileno(), msvcrt.LK_LOCK, 1)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl:
+            fcntl.flock(self._handle, fcntl.LOCK_UN)
+        else:
+            self._handle.seek(0)
+            msvcrt.locking(self._handle.fileno(), msvcrt.LK_UNLCK, 1)
+        self._handle.close()
+
+
+class RegistrationLog:
+    """JSON-lines registration log written in batches by a background thread."""
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES, backups=DEFAULT_BACKUPS, registry=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.registry = registry
+        self.lock = FileLock(path + '.lock')
+
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._closed = False
+        self.written = 0
+        self.batches = 0
+        atexit.register(self.close)
+
+    def append(self, record):
+        """Queue a record; never blocks on disk I/O, until the log is closed, when it writes directly."""
+        with self._start_lock:
+            if not self._closed:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='registration-log', daemon=True)
+                    self._thread.start()
+                self._queue.put(record)
+                return
+        self._flush([record])
+
+    def close(self):
+        """Flush everything queued so far and stop the writer; later appends are written synchronously."""
+        with self._start_lock:
+            if self._closed:
+                return
+            self._closed = True
+            running = self._thread is not None and self._thread.is_alive()
+            if running:
+                self._queue.put(None)
+        if running:
+            self._thread.join()
+
+    def migrate(self, json_path):
+        """One-shot import of the old JSON array file, which is renamed afterwards. Never raises."""
+        try:
+            with self.lock:
+                if not os.path.exists(json_path):
+                    return 0
+                with open(json_path, encoding='utf-8', errors='replace') as f:
+                    records, skipped = salvage_records(f.read())
+                if skipped:
+                    print(f"Skipped {skipped} malformed entries while migrating {json_path}")
+                if records:
+                    self._write(records)
+                os.replace(json_path, json_path + '.migrated')
+        except Exception as e:
+            print(f"Error migrating user data from {json_path}: {e}")
+            return 0
+        return len(records)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            self._flush([record for record in batch if record is not None])
+            if stop:
+                return
+
+    def _flush(self, batch):
+        try:
+            if batch:
+                with self.lock:
+                    self._write(batch)
+                if self.registry:
+                    self.registry.add_many(batch)
+        except Exception as e:
+            print(f"Error saving user data: {e}")
+
+    def _write(self, records):
+        if os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+            self._rotate()
+        data = ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self.written += len(records)
+        self.batches += 1
+
+    def _rotate(self):
+        for index in range(self.backups - 1, 0, -1):
+            older = f'{self.path}.{index}'
+            if os.path.exists(older):
+                os.replace(older, f'{self.path}.{index + 1}')
+        os.replace(self.path, self.path + '.1')
+
+
+class RegistrationRegistry:
+    """SQLite registry of registrations, indexed by phone and institution."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS registrations ('
+            ' id INTEGER PRIMARY KEY, name TEXT, phone TEXT, institution TEXT, timestamp TEXT,'
+            ' repeat INTEGER NOT NULL DEFAULT 0)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS registrations_phone ON registrations (phone)')
+        conn.execute('CREATE INDEX IF NOT EXISTS registrations_institution ON registrations (institution, repeat)')
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def is_registered(self, phone):
+        """Index lookup: has this phone number registered before?"""
+        return self._conn().execute('SELECT 1 FROM registrations WHERE phone = ? LIMIT 1', (phone,)).fetchone() is not None
+
+    def add_many(self, records):
+        """Insert records in one transaction, flagging repeat phone numbers."""
+        conn = self._conn()
+        with conn:
+            for record in records:
+                phone = record.get('phone')
+                conn.execute(
+                    'INSERT INTO registrations (name, phone, institution, timestamp, repeat) VALUES (?, ?, ?, ?, ?)',
+                    (record.get('name'), phone, record.get('institution'), record.get('timestamp'),
+                     int(self.is_registered(phone))),
+                )
+
+    def add(self, record):
+        """Insert one record; returns True when the phone number was already registered."""
+        repeat = self.is_registered(record.get('phone'))
+        self.add_many([record])
+        return repeat
+
+    def count_by_institution(self):
+        """Registrations and first-time players per institution, served from a covering index."""
+        return self._conn().execute(
+            'SELECT institution, COUNT(*), COUNT(*) - SUM(repeat) FROM registrations'
+            ' GROUP BY institution ORDER BY COUNT(*) DESC'
+        ).fetchall()
+
+    def repeat_players(self):
+        return self._conn().execute(
+            'SELECT phone, COUNT(*) FROM registrations GROUP BY phone HAVING COUNT(*) > 1 ORDER BY COUNT(*) DESC'
+        ).fetchall()
+
+    def export(self, out, batch=1000):
+        """Stream every registration to `out` as JSON lines, with bounded memory."""
+        cursor = self._conn().execute('SELECT name, phone, institution, timestamp, repeat FROM registrations ORDER BY id')
+        while True:
+            rows = cursor.fetchmany(batch)
+            if not rows:
+                break
+            for name, phone, institution, timestamp, repeat in rows:
+                out.write(json.dumps({
+                    'name': name, 'phone': phone, 'institution': institution,
+                    'timestamp': timestamp, 'repeat': bool(repeat),
+                }, ensure_ascii=False) + '\n')
+
+    def import_log(self, path, batch=1000):
+        """Load an existing JSON-lines registration log."""
+        records = []
+        with open(path, encoding='utf-8', errors='replace') as f:
+            for number, line in enumerate(f, 1):
+                if line.strip():
+                    try:
+                        record = json.loads(line)
+                    except ValueError as e:
+                        print(f"Skipping malformed line {number} of {path}: {e}")
+                        continue
+                    if isinstance(record, dict):
+                        records.append(record)
+                    else:
+                        print(f"Skipping malformed line {number} of {path}: not a JSON object")
+                if len(records) >= batch:
+                    self.add_many(records)
+                    records = []
+        self.add_many(records)
+
+
+def registry_from_env():
+    """The registry configured by AKI_REGISTRY_DB, if any."""
+    path = os.environ.get('AKI_REGISTRY_DB')
+    return RegistrationRegistry(path) if path else None
+
+
+if __name__ == '__main__':
+    # python registrations.py <registry.db> counts|repeats|export|import <log.jsonl>
+    registry = RegistrationRegistry(sys.argv[1])
+    command = sys.argv[2] if len(sys.argv) > 2 else 'counts'
+    if command == 'counts':
+        for institution, total, players in registry.count_by_institution():
+            print(f"{total:8d} {players:8d}  {institution}")
+    elif command == 'repeats':
+        for phone, visits in registry.repeat_players():
+            print(f"{visits:4d}  {phone}")
+    elif command == 'export':
+        registry.export(sys.stdout)
+    elif command == 'import':
+        registry.import_log(sys.argv[3])
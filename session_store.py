@@ -0,0 +1,295 @@
+# Game session storage for the JSON API in app.py.
+#
+# SessionStore is the interface; MemorySessionStore keeps live clients in
+# process with an idle TTL, a hard entry limit and an approximate byte budget.
+# Every read or write moves the entry to the end of an OrderedDict, so the
+# front is both the least recently used entry and the next one to expire:
+# expiry and eviction only ever pop from the front, with no full scans.
+#
+# SQLiteSessionStore keeps only the serialized game state in a WAL-mode
+# database, so several worker processes can share games; clients are rebuilt
+# from that state on every request.
+#
+# lock() serializes requests for one game: a per-session lock in memory, a
+# leased row lock in SQLite. A request that can't get it within LOCK_TIMEOUT
+# gets SessionBusy rather than waiting on a slow upstream call indefinitely.
+
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from aki_client import Client
+from metrics import registry
+
+DEFAULT_TTL = float(os.environ.get('AKI_SESSION_TTL', 900))
+DEFAULT_MAX_ENTRIES = int(os.environ.get('AKI_SESSION_MAX_ENTRIES', 10000))
+DEFAULT_MAX_BYTES = int(os.environ.get('AKI_SESSION_MAX_BYTES', 64 * 1024 * 1024))
+TOMBSTONES = 10000
+LOCK_LEASE = 30.0
+LOCK_TIMEOUT = 10.0
+
+
+def approx_size(value):
+    """Rough retained size of a session entry, in bytes."""
+    if hasattr(value, 'to_state'):
+        # Count a client by its game state, never by its (shared) transport
+        return sys.getsizeof(value) + approx_size(value.to_state())
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(approx_size(k) + approx_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(approx_size(item) for item in value)
+    return sys.getsizeof(value)
+
+
+class SessionBusy(TimeoutError):
+    """Another request held the session's lock for longer than LOCK_TIMEOUT."""
+
+
+_stores = weakref.WeakSet()
+
+
+class SessionStore:
+    """Interface for game session backends."""
+
+    def __init__(self):
+        # session id -> [lock, holders and waiters]; an entry lives only while someone uses it
+        self._session_locks = {}
+        self._session_locks_guard = threading.Lock()
+        _stores.add(self)
+
+    @contextmanager
+    def lock(self, session_id):
+        """Serialize read-modify-write cycles on one session; raises SessionBusy after LOCK_TIMEOUT."""
+        with self._session_locks_guard:
+            held = self._session_locks.get(session_id)
+            if held is None:
+                held = self._session_locks[session_id] = [threading.Lock(), 0]
+            held[1] += 1
+        try:
+            if not held[0].acquire(timeout=LOCK_TIMEOUT):
+                raise SessionBusy("The game is busy with another request.")
+            try:
+                yield
+            finally:
+                held[0].release()
+        finally:
+            with self._session_locks_guard:
+                held[1] -= 1
+                if not held[1]:
+                    del self._session_locks[session_id]
+
+    def get(self, session_id):
+        """Return the entry for `session_id`, or None."""
+        raise NotImplementedError
+
+    def put(self, session_id, entry):
+        """Create or replace the entry for `session_id`."""
+        raise NotImplementedError
+
+    def delete(self, session_id):
+        raise NotImplementedError
+
+    def expired(self, session_id):
+        """Whether `session_id` existed but was expired or evicted."""
+        return False
+
+    def stats(self):
+        return {}
+
+
+class MemorySessionStore(SessionStore):
+    """In-process store with idle TTL, entry limit and byte budget, enforced LRU-first."""
+
+    def __init__(self, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES, sizer=approx_size):
+        super().__init__()
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizer = sizer
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._tombstones = OrderedDict()
+        self._bytes = 0
+        self.evictions = {'expired': 0, 'entries': 0, 'bytes': 0}
+
+    def get(self, session_id):
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            item = self._entries.get(session_id)
+            if item is None:
+                return None
+            entry, size, _ = item
+            self._entries[session_id] = (entry, size, now)
+            self._entries.move_to_end(session_id)
+            return entry
+
+    def put(self, session_id, entry):
+        size = self.sizer(entry)
+        now = time.monotonic()
+        with self._lock:
+            old = self._entries.pop(session_id, None)
+            if old:
+                self._bytes -= old[1]
+            self._entries[session_id] = (entry, size, now)
+            self._bytes += size
+            self._tombstones.pop(session_id, None)
+            self._expire(now)
+            while len(self._entries) > self.max_entries:
+                self._evict('entries')
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                self._evict('bytes')
+
+    def delete(self, session_id):
+        with self._lock:
+            item = self._entries.pop(session_id, None)
+            if item:
+                self._bytes -= item[1]
+
+    def expired(self, session_id):
+        with self._lock:
+            return session_id in self._tombstones
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes, 'evictions': dict(self.evictions)}
+
+    def _expire(self, now):
+        while self._entries:
+            _, (_, _, last_used) = next(iter(self._entries.items()))
+            if now - last_used < self.ttl:
+                break
+            self._evict('expired')
+
+    def _evict(self, reason):
+        session_id, (_, size, _) = self._entries.popitem(last=False)
+        self._bytes -= size
+        self.evictions[reason] += 1
+        self._tombstones[session_id] = None
+        if len(self._tombstones) > TOMBSTONES:
+            self._tombstones.popitem(last=False)
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Shared store for multiple worker processes, backed by SQLite in WAL mode.
+
+    Rows hold the serialized client state and player info. Sessions idle longer
+    than `ttl` read as expired, and are purged once they are twice that old.
+    """
+
+    def __init__(self, path, ttl=DEFAULT_TTL, client_factory=Client):
+        super().__init__()
+        self.path = path
+        self.ttl = ttl
+        self.client_factory = client_factory
+        self._local = threading.local()
+        self._writes = 0
+        self.evictions = {'expired': 0}
+
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS sessions ('
+            ' id TEXT PRIMARY KEY, state TEXT NOT NULL, user_info TEXT, updated_at REAL NOT NULL,'
+            ' lock_token TEXT, lock_expires REAL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)')
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=LOCK_TIMEOUT, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, session_id):
+        row = self._conn().execute(
+            'SELECT state, user_info, updated_at FROM sessions WHERE id = ?', (session_id,)
+        ).fetchone()
+        if row is None or time.time() - row[2] >= self.ttl:
+            return None
+        return {
+            'client': self.client_factory.from_state(json.loads(row[0])),
+            'user_info': json.loads(row[1]) if row[1] else None,
+        }
+
+    def put(self, session_id, entry):
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            'INSERT INTO sessions (id, state, user_info, updated_at) VALUES (?, ?, ?, ?)'
+            ' ON CONFLICT (id) DO UPDATE SET state = excluded.state, user_info = excluded.user_info,'
+            ' updated_at = excluded.updated_at',
+            (session_id, json.dumps(entry['client'].to_state()), json.dumps(entry.get('user_info')), now),
+        )
+        self._writes += 1
+        if self._writes % 100 == 0:
+            cursor = conn.execute('DELETE FROM sessions WHERE updated_at < ?', (now - 2 * self.ttl,))
+            self.evictions['expired'] += cursor.rowcount
+
+    def delete(self, session_id):
+        self._conn().execute('DELETE FROM sessions WHERE id = ?', (session_id,))
+
+    def expired(self, session_id):
+        row = self._conn().execute('SELECT updated_at FROM sessions WHERE id = ?', (session_id,)).fetchone()
+        return row is not None and time.time() - row[0] >= self.ttl
+
+    @contextmanager
+    def lock(self, session_id):
+        """
+        Hold a leased row lock, so answers for one game are serialized across
+        processes and threads alike; raises SessionBusy after LOCK_TIMEOUT.
+        """
+        conn = self._conn()
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        while True:
+            now = time.time()
+            cursor = conn.execute(
+                'UPDATE sessions SET lock_token = ?, lock_expires = ?'
+                ' WHERE id = ? AND (lock_token IS NULL OR lock_expires < ?)',
+                (token, now + LOCK_LEASE, session_id, now),
+            )
+            if cursor.rowcount:
+                break
+            if conn.execute('SELECT 1 FROM sessions WHERE id = ?', (session_id,)).fetchone() is None:
+                # Nothing to lock; the caller will find the session missing
+                token = None
+                break
+            if time.monotonic() > deadline:
+                raise SessionBusy("The game is busy with another request.")
+            time.sleep(0.01)
+        try:
+            yield
+        finally:
+            if token:
+                conn.execute(
+                    'UPDATE sessions SET lock_token = NULL, lock_expires = NULL WHERE id = ? AND lock_token = ?',
+                    (session_id, token),
+                )
+
+    def stats(self):
+        count = self._conn().execute('SELECT COUNT(*) FROM sessions').fetchone()[0]
+        return {'entries': count, 'evictions': dict(self.evictions)}
+
+
+@registry.collector
+def session_metrics():
+    for store in list(_stores):
+        stats = store.stats()
+        backend = type(store).__name__
+        yield 'aki_sessions', {'backend': backend}, stats['entries']
+        if 'bytes' in stats:
+            yield 'aki_session_bytes', {'backend': backend}, stats['bytes']
+        for reason, count in stats['evictions'].items():
+            yield 'aki_session_evictions_total', {'backend': backend, 'reason': reason}, count
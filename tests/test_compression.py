@@ -0,0 +1,59 @@
+from flask import Flask, session
+
+from compression import CompressionMiddleware
+
+PAGE = '<html><body>' + '<p>Is your character real?</p>' * 100 + '</body></html>'
+
+
+def make_app():
+    app = Flask(__name__)
+    app.secret_key = 'test'
+
+    @app.route('/')
+    def page():
+        session['step'] = 1
+        return PAGE
+
+    app.wsgi_app = CompressionMiddleware(app.wsgi_app)
+    return app
+
+
+def vary_tokens(response):
+    return {token.strip() for token in response.headers.get('Vary', '').split(',')}
+
+
+def test_session_page_keeps_vary_cookie_when_compressed():
+    response = make_app().test_client().get('/', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert {'Cookie', 'Accept-Encoding'} <= vary_tokens(response)
+
+
+def test_session_page_keeps_vary_cookie_uncompressed():
+    response = make_app().test_client().get('/')
+    assert 'Content-Encoding' not in response.headers
+    assert {'Cookie', 'Accept-Encoding'} <= vary_tokens(response)
+
+
+def test_ineligible_responses_stream_through_unbuffered():
+    closed = []
+
+    class Stream:
+        def __iter__(self):
+            yield b'\x89PNG' + b'\0' * 4096
+
+        def close(self):
+            closed.append(True)
+
+    def image(environ, start_response):
+        start_response('200 OK', [('Content-Type', 'image/png')])
+        return Stream()
+
+    app_iter = CompressionMiddleware(image)({'HTTP_ACCEPT_ENCODING': 'gzip'}, lambda *args: None)
+    assert isinstance(app_iter, Stream)
+    assert not closed
+
+
+def test_only_shared_bodies_are_cached():
+    app = make_app()
+    app.test_client().get('/', headers={'Accept-Encoding': 'gzip'})
+    assert not app.wsgi_app._cache
@@ -0,0 +1,169 @@
+# Shared SSL contexts and TLS session resumption for CloudScraper.
+#
+# cloudscraper's CipherSuiteAdapter builds a fresh SSLContext for every
+# scraper, loading the CA bundle and setting ciphers and the ECDH curve each
+# time, and a fresh context can't resume another context's TLS sessions, so
+# every new scraper also pays a full handshake. Here contexts are built once
+# per (cipher suite, ECDH curve, server_hostname) and shared, and each keeps
+# the latest TLS session per host so new connections to {lang}.akinator.com
+# resume it instead of doing a full handshake.
+#
+# install() points cloudscraper at SharedContextAdapter; aki_transport calls
+# it on import. Contexts are shared, so settings made per scraper leak into
+# every scraper using the same context: verify=False would weaken all of
+# them, and a CA bundle passed as verify= is trusted by all of them.
+
+import ssl
+import threading
+import time
+import weakref
+
+import cloudscraper
+from cloudscraper import CipherSuiteAdapter
+from requests.adapters import HTTPAdapter
+
+from metrics import registry
+
+
+class SharedContext:
+    """One SSLContext configured like CipherSuiteAdapter's, remembering TLS sessions per host."""
+
+    def __init__(self, cipher_suite, ecdh_curve='prime256v1', server_hostname=None):
+        context = ssl.create_default_context(ssl.Purpose.SERVER_AUTH)
+        if cipher_suite:
+            context.set_ciphers(cipher_suite)
+        context.set_ecdh_curve(ecdh_curve)
+        context.minimum_version = ssl.TLSVersion.TLSv1_2
+        context.maximum_version = ssl.TLSVersion.TLSv1_3
+        if server_hostname:
+            context.server_hostname = server_hostname
+        # Same hook CipherSuiteAdapter installs, plus session reuse
+        context.orig_wrap_socket = context.wrap_socket
+        context.wrap_socket = self.wrap_socket
+
+        self.context = context
+        self.server_hostname = server_hostname
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._latest = {}
+        self.handshakes = 0
+        self.resumed = 0
+
+    def _session(self, host):
+        with self._lock:
+            # TLS 1.3 tickets arrive after the handshake, so prefer what the newest live connection has by now
+            latest = self._latest.get(host)
+            sock = latest() if latest is not None else None
+            if sock is not None:
+                try:
+                    if sock.session is not None:
+                        self._sessions[host] = sock.session
+                except (OSError, ValueError):
+                    pass
+            session = self._sessions.get(host)
+            if session is not None and session.time + session.timeout <= time.time():
+                del self._sessions[host]
+                session = None
+            return session
+
+    def wrap_socket(self, sock, *args, **kwargs):
+        if self.server_hostname:
+            kwargs['server_hostname'] = self.server_hostname
+            self.context.check_hostname = False
+        else:
+            self.context.check_hostname = True
+
+        host = kwargs.get('server_hostname')
+        if host and kwargs.get('session') is None:
+            kwargs['session'] = self._session(host)
+        sslsock = self.context.orig_wrap_socket(sock, *args, **kwargs)
+
+        if host:
+            with self._lock:
+                self.handshakes += 1
+                self.resumed += sslsock.session_reused
+                self._latest[host] = weakref.ref(sslsock)
+                if sslsock.session is not None:
+                    self._sessions[host] = sslsock.session
+        return sslsock
+
+    def stats(self):
+        with self._lock:
+            return {'handshakes': self.handshakes, 'resumed': self.resumed, 'hosts': len(self._sessions)}
+
+
+class SSLContextCache:
+    """Process-wide SharedContexts keyed by (cipher suite, ECDH curve, server_hostname)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._contexts = {}
+
+    def get(self, cipher_suite, ecdh_curve='prime256v1', server_hostname=None):
+        key = (cipher_suite, ecdh_curve, server_hostname)
+        shared = self._contexts.get(key)
+        if shared is None:
+            with self._lock:
+                shared = self._contexts.get(key)
+                if shared is None:
+                    shared = self._contexts[key] = SharedContext(cipher_suite, ecdh_curve, server_hostname)
+        return shared.context
+
+    def stats(self):
+        totals = {'contexts': len(self._contexts), 'handshakes': 0, 'resumed': 0}
+        for shared in list(self._contexts.values()):
+            stats = shared.stats()
+            totals['handshakes'] += stats['handshakes']
+            totals['resumed'] += stats['resumed']
+        return totals
+
+
+ssl_contexts = SSLContextCache()
+
+
+class SharedContextAdapter(HTTPAdapter):
+    """
+    Stand-in for CipherSuiteAdapter, taking the same arguments, that uses an
+    SSLContext from `ssl_contexts` instead of building one. (Not a subclass:
+    CipherSuiteAdapter's methods call super() through the module global this replaces.)
+    """
+
+    __attrs__ = CipherSuiteAdapter.__attrs__
+
+    def __init__(self, *args, **kwargs):
+        self.cipherSuite = kwargs.pop('cipherSuite', None)
+        self.ecdhCurve = kwargs.pop('ecdhCurve', 'prime256v1')
+        self.server_hostname = kwargs.pop('server_hostname', None)
+        self.source_address = kwargs.pop('source_address', None)
+        self.ssl_context = kwargs.pop('ssl_context', None) or ssl_contexts.get(
+            self.cipherSuite, self.ecdhCurve, self.server_hostname)
+
+        if isinstance(self.source_address, str):
+            self.source_address = (self.source_address, 0)
+        if self.source_address is not None and not isinstance(self.source_address, tuple):
+            raise TypeError("source_address must be IP address string or (ip, port) tuple")
+
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['ssl_context'] = self.ssl_context
+        kwargs['source_address'] = self.source_address
+        return super().init_poolmanager(*args, **kwargs)
+
+    def proxy_manager_for(self, *args, **kwargs):
+        kwargs['ssl_context'] = self.ssl_context
+        kwargs['source_address'] = self.source_address
+        return super().proxy_manager_for(*args, **kwargs)
+
+
+def install():
+    """Make every CloudScraper created from now on use SharedContextAdapter."""
+    cloudscraper.CipherSuiteAdapter = SharedContextAdapter
+
+
+@registry.collector
+def tls_metrics():
+    stats = ssl_contexts.stats()
+    yield 'aki_tls_contexts', {}, stats['contexts']
+    yield 'aki_tls_handshakes', {'resumed': 'false'}, stats['handshakes'] - stats['resumed']
+    yield 'aki_tls_handshakes', {'resumed': 'true'}, stats['resumed']
@@ -0,0 +1,233 @@
+# Lightweight request tracing.
+#
+# A sampled request gets a trace, kept in a context variable so any code on
+# the request's path can add spans to it with `span(name)` without passing it
+# around. Unsampled requests pay one ContextVar lookup per span. Finished
+# traces are queued to a background thread that appends them to a
+# size-rotated JSON-lines file.
+#
+# Summarize a trace file with:  python tracing.py traces.jsonl [top]
+
+import contextvars
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from flask import template_rendered, before_render_template
+from flask.sessions import SecureCookieSessionInterface
+
+DEFAULT_SAMPLE_RATE = float(os.environ.get('AKI_TRACE_SAMPLE', 0.01))
+DEFAULT_PATH = os.environ.get('AKI_TRACE_FILE', 'traces.jsonl')
+DEFAULT_MAX_BYTES = int(os.environ.get('AKI_TRACE_MAX_BYTES', 20 * 1024 * 1024))
+DEFAULT_BACKUPS = 3
+
+_current = contextvars.ContextVar('aki_trace', default=None)
+
+
+class Trace:
+    """Spans recorded for one request."""
+
+    def __init__(self, name):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.started_at = time.time()
+        self.origin = time.perf_counter()
+        self.spans = []
+        self._open = {}
+
+    def add(self, name, started, ended):
+        self.spans.append((name, started - self.origin, ended - started))
+
+    def to_record(self, duration):
+        return {
+            'trace_id': self.id,
+            'name': self.name,
+            'start': round(self.started_at, 6),
+            'duration_ms': round(duration * 1e3, 3),
+            'spans': [
+                {'name': name, 'start_ms': round(offset * 1e3, 3), 'duration_ms': round(length * 1e3, 3)}
+                for name, offset, length in self.spans
+            ],
+        }
+
+
+def current_trace():
+    """The trace of the request being handled, or None when it isn't sampled."""
+    return _current.get()
+
+
+@contextmanager
+def span(name):
+    """Time the block as a span of the current trace, if there is one."""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, started, time.perf_counter())
+
+
+class JsonlExporter:
+    """Appends finished traces to a rotating JSON-lines file from a background thread."""
+
+    def __init__(self, path=DEFAULT_PATH, max_bytes=DEFAULT_MAX_BYTES, backups=DEFAULT_BACKUPS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._queue = queue.Queue(maxsize=10000)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.dropped = 0
+
+    def export(self, record):
+        """Queue a trace record; drops it rather than block when the writer falls behind."""
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='trace-exporter', daemon=True)
+                    self._thread.start()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                if os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+                    self._rotate()
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(''.join(json.dumps(record) + '\n' for record in batch))
+            except Exception as e:
+                print(f"Error writing traces: {e}")
+
+    def _rotate(self):
+        for index in range(self.backups - 1, 0, -1):
+            older = f'{self.path}.{index}'
+            if os.path.exists(older):
+                os.replace(older, f'{self.path}.{index + 1}')
+        os.replace(self.path, self.path + '.1')
+
+
+class TracingMiddleware:
+    """Starts a trace for a sampled share of requests and exports it when the response is done."""
+
+    def __init__(self, app, exporter=None, sample_rate=DEFAULT_SAMPLE_RATE):
+        self.app = app
+        self.exporter = exporter or JsonlExporter()
+        self.sample_rate = sample_rate
+
+    def __call__(self, environ, start_response):
+        if not self.sample_rate or random.random() >= self.sample_rate:
+            return self.app(environ, start_response)
+
+        trace = Trace(f"{environ.get('REQUEST_METHOD', 'GET')} {environ.get('PATH_INFO', '/')}")
+        token = _current.set(trace)
+        started = time.perf_counter()
+
+        def traced_start_response(status, headers, exc_info=None):
+            headers.append(('X-Trace-Id', trace.id))
+            return start_response(status, headers, exc_info)
+
+        try:
+            # Buffer so the trace covers producing the whole body, closing the app's iterable as WSGI requires
+            app_iter = self.app(environ, traced_start_response)
+            try:
+                body = list(app_iter)
+            finally:
+                if hasattr(app_iter, 'close'):
+                    app_iter.close()
+        finally:
+            _current.reset(token)
+            self.exporter.export(trace.to_record(time.perf_counter() - started))
+        return body
+
+
+class TracedSessionInterface(SecureCookieSessionInterface):
+    """The default signed-cookie session, with decode and encode recorded as spans."""
+
+    def open_session(self, app, request):
+        with span('session_decode'):
+            return super().open_session(app, request)
+
+    def save_session(self, app, session, response):
+        with span('session_encode'):
+            return super().save_session(app, session, response)
+
+
+def _render_started(sender, template, context, **extra):
+    trace = _current.get()
+    if trace is not None:
+        trace._open[id(template)] = time.perf_counter()
+
+
+def _render_finished(sender, template, context, **extra):
+    trace = _current.get()
+    if trace is not None:
+        started = trace._open.pop(id(template), None)
+        if started is not None:
+            trace.add('render', started, time.perf_counter())
+
+
+def instrument_tracing(app, exporter=None, sample_rate=DEFAULT_SAMPLE_RATE):
+    """Trace a sampled share of `app`'s requests: session cookie, rendering and whatever calls `span`."""
+    app.session_interface = TracedSessionInterface()
+    before_render_template.connect(_render_started, app)
+    template_rendered.connect(_render_finished, app)
+    app.wsgi_app = TracingMiddleware(app.wsgi_app, exporter, sample_rate)
+    return app.wsgi_app
+
+
+def _percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def summarize(paths, top=10, out=sys.stdout):
+    """Print the slowest traces and per-stage latency percentiles from trace files."""
+    traces = []
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            traces += [json.loads(line) for line in f if line.strip()]
+    if not traces:
+        out.write("No traces.\n")
+        return
+
+    out.write(f"Slowest {min(top, len(traces))} of {len(traces)} traces:\n")
+    for trace in sorted(traces, key=lambda t: t['duration_ms'], reverse=True)[:top]:
+        stages = ', '.join(f"{s['name']} {s['duration_ms']:.1f}" for s in trace['spans'])
+        out.write(f"{trace['duration_ms']:10.1f}ms  {trace['trace_id']}  {trace['name']}  [{stages}]\n")
+
+    stages = {}
+    for trace in traces:
+        totals = {}
+        for s in trace['spans']:
+            totals[s['name']] = totals.get(s['name'], 0.0) + s['duration_ms']
+        totals['(total)'] = trace['duration_ms']
+        for name, value in totals.items():
+            stages.setdefault(name, []).append(value)
+
+    out.write(f"\n{'stage':<24} {'count':>7} {'p50':>10} {'p90':>10} {'p99':>10}\n")
+    for name, values in sorted(stages.items()):
+        out.write(f"{name:<24} {len(values):7d} " + ' '.join(
+            f"{_percentile(values, p):8.1f}ms" for p in (50, 90, 99)) + '\n')
+
+
+if __name__ == '__main__':
+    # python tracing.py traces.jsonl [top]
+    summarize([sys.argv[1]], top=int(sys.argv[2]) if len(sys.argv) > 2 else 10)
@@ -0,0 +1,285 @@
+# Failing fast when Akinator is degraded or the server is overloaded.
+#
+# Each upstream host (one per language, e.g. en.akinator.com) has a circuit
+# breaker fed with the outcome and latency of every request. Once too many
+# recent requests fail or run slow the circuit opens and calls are refused
+# immediately; after a cool-down a few probe requests are let through, and
+# their outcome decides whether it closes again. Calls carry a ticket from
+# admission to outcome, so only the probes themselves decide a half-open
+# circuit, not stragglers admitted before it opened.
+#
+# Independently, a process-wide limiter caps concurrent upstream requests.
+# Callers beyond the cap wait in a bounded queue for a short time, and are
+# turned away once it is full, so overload shows up as quick 503s rather than
+# threads piling up behind a slow upstream. Coroutines queue for the same
+# slots through async_slot, without blocking their event loop.
+
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+from akinator.exceptions import AkinatorException
+
+from metrics import registry
+
+DEFAULT_WINDOW = float(os.environ.get('AKI_BREAKER_WINDOW', 30))
+DEFAULT_MIN_REQUESTS = int(os.environ.get('AKI_BREAKER_MIN_REQUESTS', 10))
+DEFAULT_FAILURE_RATE = float(os.environ.get('AKI_BREAKER_FAILURE_RATE', 0.5))
+DEFAULT_SLOW_CALL = float(os.environ.get('AKI_BREAKER_SLOW_CALL', 5))
+DEFAULT_SLOW_RATE = float(os.environ.get('AKI_BREAKER_SLOW_RATE', 0.8))
+DEFAULT_OPEN_FOR = float(os.environ.get('AKI_BREAKER_OPEN_FOR', 15))
+DEFAULT_PROBES = 2
+
+DEFAULT_CONCURRENCY = int(os.environ.get('AKI_UPSTREAM_CONCURRENCY', 32))
+DEFAULT_QUEUE = int(os.environ.get('AKI_UPSTREAM_QUEUE', 64))
+DEFAULT_QUEUE_WAIT = float(os.environ.get('AKI_UPSTREAM_QUEUE_WAIT', 2))
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+
+class UpstreamUnavailable(AkinatorException):
+    """Akinator can't be used right now; the request may be retried after `retry_after` seconds."""
+
+    retry_after = 2
+
+    def __init__(self, message="Akinator is unavailable right now.", retry_after=None):
+        super().__init__(message)
+        if retry_after is not None:
+            self.retry_after = max(1, int(retry_after + 0.5))
+
+
+class CircuitOpen(UpstreamUnavailable):
+    """Refused without contacting the host, because its circuit is open."""
+
+
+class Overloaded(UpstreamUnavailable):
+    """Refused because too many upstream requests are already in flight or queued."""
+
+
+class CircuitBreaker:
+    """Error-rate and latency circuit breaker for one upstream host."""
+
+    def __init__(self, window=DEFAULT_WINDOW, min_requests=DEFAULT_MIN_REQUESTS, failure_rate=DEFAULT_FAILURE_RATE,
+                 slow_call=DEFAULT_SLOW_CALL, slow_rate=DEFAULT_SLOW_RATE, open_for=DEFAULT_OPEN_FOR,
+                 probes=DEFAULT_PROBES):
+        self.window = window
+        self.min_requests = min_requests
+        self.failure_rate = failure_rate
+        self.slow_call = slow_call
+        self.slow_rate = slow_rate
+        self.open_for = open_for
+        self.probes = probes
+
+        self._lock = threading.Lock()
+        self._calls = deque()
+        self._failures = 0
+        self._slow = 0
+        self.state = CLOSED
+        self._opened_at = 0.0
+        self._phase = 0
+        self._probing = 0
+        self._probe_successes = 0
+        self.opened = 0
+        self.rejected = 0
+
+    def before(self):
+        """
+        Raise CircuitOpen unless a request may go out now. Returns the ticket to
+        pass to `record` or `release`: 0 for a normal call, or the number of the
+        half-open phase the call is probing.
+        """
+        with self._lock:
+            if self.state == OPEN:
+                remaining = self._opened_at + self.open_for - time.monotonic()
+                if remaining > 0:
+                    self.rejected += 1
+                    raise CircuitOpen(retry_after=remaining)
+                self.state = HALF_OPEN
+                self._phase += 1
+                self._probing = 0
+                self._probe_successes = 0
+            if self.state == HALF_OPEN:
+                if self._probing >= self.probes:
+                    self.rejected += 1
+                    raise CircuitOpen(retry_after=1)
+                self._probing += 1
+                return self._phase
+            return 0
+
+    def record(self, ticket, ok, latency):
+        """Report the outcome of a request that `before` let through with `ticket`."""
+        now = time.monotonic()
+        slow = latency >= self.slow_call
+        with self._lock:
+            if ticket:
+                # Only probes of the current half-open phase decide it
+                if self.state != HALF_OPEN or ticket != self._phase:
+                    return
+                self._probing -= 1
+                if ok and not slow:
+                    self._probe_successes += 1
+                    if self._probe_successes >= self.probes:
+                        self._reset()
+                else:
+                    self._open(now)
+                return
+            if self.state != CLOSED:
+                # Admitted before the circuit opened: too late to count either way
+                return
+
+            self._calls.append((now, ok, slow))
+            self._failures += not ok
+            self._slow += slow
+            while self._calls and now - self._calls[0][0] > self.window:
+                _, old_ok, old_slow = self._calls.popleft()
+                self._failures -= not old_ok
+                self._slow -= old_slow
+
+            total = len(self._calls)
+            if total >= self.min_requests and (
+                    self._failures / total >= self.failure_rate or self._slow / total >= self.slow_rate):
+                self._open(now)
+
+    def release(self, ticket):
+        """Hand back a request `before` let through that ended without an outcome, e.g. cancelled."""
+        with self._lock:
+            if ticket and self.state == HALF_OPEN and ticket == self._phase:
+                self._probing -= 1
+
+    def _open(self, now):
+        self.state = OPEN
+        self._opened_at = now
+        self.opened += 1
+
+    def _reset(self):
+        self.state = CLOSED
+        self._calls.clear()
+        self._failures = 0
+        self._slow = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'requests': len(self._calls),
+                'failures': self._failures,
+                'slow': self._slow,
+                'opened': self.opened,
+                'rejected': self.rejected,
+            }
+
+
+class BreakerRegistry:
+    """One CircuitBreaker per upstream host, created on first use."""
+
+    def __init__(self, **options):
+        self.options = options
+        self._lock = threading.Lock()
+        self._breakers = {}
+
+    def get(self, host):
+        breaker = self._breakers.get(host)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(host, CircuitBreaker(**self.options))
+        return breaker
+
+    def stats(self):
+        return {host: breaker.stats() for host, breaker in list(self._breakers.items())}
+
+
+class ConcurrencyLimiter:
+    """Caps concurrent work, with a bounded, time-limited wait queue in front of it."""
+
+    def __init__(self, limit=DEFAULT_CONCURRENCY, queue=DEFAULT_QUEUE, wait=DEFAULT_QUEUE_WAIT):
+        self.limit = limit
+        self.queue = queue
+        self.wait = wait
+
+        self._cond = threading.Condition()
+        self.active = 0
+        self.waiting = 0
+        self.shed = 0
+
+    @contextmanager
+    def slot(self, wait=None):
+        """Hold one of the `limit` slots for the block, or raise Overloaded."""
+        wait = self.wait if wait is None else min(wait, self.wait)
+        with self._cond:
+            if self.active >= self.limit:
+                if self.waiting >= self.queue:
+                    self.shed += 1
+                    raise Overloaded("The server is busy right now.")
+                self.waiting += 1
+                try:
+                    admitted = self._cond.wait_for(lambda: self.active < self.limit, timeout=wait)
+                finally:
+                    self.waiting -= 1
+                if not admitted:
+                    self.shed += 1
+                    raise Overloaded("The server is busy right now.")
+            self.active += 1
+        try:
+            yield
+        finally:
+            self._release()
+
+    @asynccontextmanager
+    async def async_slot(self, wait=None):
+        """`slot` for coroutines: queued callers poll instead of blocking the event loop."""
+        wait = self.wait if wait is None else min(wait, self.wait)
+        with self._cond:
+            admitted = self.active < self.limit
+            if admitted:
+                self.active += 1
+            elif self.waiting >= self.queue:
+                self.shed += 1
+                raise Overloaded("The server is busy right now.")
+            else:
+                self.waiting += 1
+        if not admitted:
+            deadline = time.monotonic() + wait
+            try:
+                while not admitted:
+                    await asyncio.sleep(0.01)
+                    with self._cond:
+                        admitted = self.active < self.limit
+                        if admitted:
+                            self.active += 1
+                        elif time.monotonic() >= deadline:
+                            self.shed += 1
+                            raise Overloaded("The server is busy right now.")
+            finally:
+                with self._cond:
+                    self.waiting -= 1
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {'active': self.active, 'waiting': self.waiting, 'shed': self.shed}
+
+
+breakers = BreakerRegistry()
+upstream_limiter = ConcurrencyLimiter()
+
+
+@registry.collector
+def guard_metrics():
+    for host, stats in breakers.stats().items():
+        yield 'aki_breaker_open', {'host': host}, int(stats['state'] != CLOSED)
+        yield 'aki_breaker_rejected', {'host': host}, stats['rejected']
+    stats = upstream_limiter.stats()
+    yield 'aki_upstream_active', {}, stats['active']
+    yield 'aki_upstream_queued', {}, stats['waiting']
+    yield 'aki_upstream_shed', {}, stats['shed']
@@ -0,0 +1,152 @@
+# Browser profiles for CloudScraper, parsed once per process.
+#
+# cloudscraper's User_Agent re-reads and re-parses browsers.json (about 9,000
+# user-agent strings) into nested OrderedDicts, then filters it, every time a
+# scraper is constructed. Here the file is parsed on first use into an
+# immutable index keyed by (browser, platform, device), plus the merged
+# candidate list for each (platform, desktop, mobile) filter, so picking a
+# profile for a new scraper is a couple of dict lookups and a random choice.
+#
+# install() points cloudscraper at CachedUserAgent; aki_transport calls it on
+# import so every scraper built in this process uses the cached catalog.
+
+import json
+import os
+import random
+import ssl
+import sys
+from collections import OrderedDict
+from functools import lru_cache
+from types import MappingProxyType
+
+import cloudscraper
+from cloudscraper.user_agent import User_Agent
+
+PLATFORMS = ('linux', 'windows', 'darwin', 'android', 'ios')
+BROWSERS = ('chrome', 'firefox')
+DEVICES = ('desktop', 'mobile')
+
+
+class UserAgentCatalog:
+    """Read-only index over cloudscraper's browsers.json."""
+
+    def __init__(self, data):
+        self.headers = MappingProxyType({
+            browser: tuple(headers.items()) for browser, headers in data['headers'].items()
+        })
+        self.cipher_suites = MappingProxyType({
+            browser: tuple(suite) for browser, suite in data['cipherSuite'].items()
+        })
+        self.agents = MappingProxyType({
+            (browser, platform, device): tuple(agents)
+            for device, platforms in data['user_agents'].items()
+            for platform, browsers in platforms.items()
+            for browser, agents in browsers.items()
+        })
+        # Same precedence as User_Agent.filterAgents: a browser's desktop list replaces its mobile one
+        pools = {}
+        for platform in PLATFORMS:
+            for desktop in (True, False):
+                for mobile in (True, False):
+                    merged = {}
+                    for device, enabled in (('mobile', mobile), ('desktop', desktop)):
+                        if enabled:
+                            for browser in BROWSERS:
+                                if (browser, platform, device) in self.agents:
+                                    merged[browser] = self.agents[browser, platform, device]
+                    pools[platform, desktop, mobile] = MappingProxyType(
+                        {browser: agents for browser, agents in merged.items() if agents})
+        self.pools = MappingProxyType(pools)
+
+    def match_custom(self, custom):
+        """The browser whose known user agents include `custom`, if any."""
+        for (browser, _, _), agents in self.agents.items():
+            if any(custom in agent for agent in agents):
+                return browser
+        return None
+
+
+@lru_cache(maxsize=None)
+def catalog():
+    """The process-wide catalog, loaded on first use."""
+    path = os.path.join(os.path.dirname(sys.modules[User_Agent.__module__].__file__), 'browsers.json')
+    with open(path, 'r') as fp:
+        return UserAgentCatalog(json.load(fp))
+
+
+class CachedUserAgent(User_Agent):
+    """Drop-in `User_Agent` that picks its profile from the shared catalog instead of re-reading the file."""
+
+    def loadUserAgent(self, *args, **kwargs):
+        self.browser = kwargs.pop('browser', None)
+
+        self.platforms = list(PLATFORMS)
+        self.browsers = list(BROWSERS)
+
+        if isinstance(self.browser, dict):
+            self.custom = self.browser.get('custom', None)
+            self.platform = self.browser.get('platform', None)
+            self.desktop = self.browser.get('desktop', True)
+            self.mobile = self.browser.get('mobile', True)
+            self.browser = self.browser.get('browser', None)
+        else:
+            self.custom = kwargs.pop('custom', None)
+            self.platform = kwargs.pop('platform', None)
+            self.desktop = kwargs.pop('desktop', True)
+            self.mobile = kwargs.pop('mobile', True)
+
+        if not self.desktop and not self.mobile:
+            raise RuntimeError("Sorry you can't have mobile and desktop disabled at the same time.")
+
+        profiles = catalog()
+        if self.custom:
+            browser = profiles.match_custom(self.custom)
+            if browser:
+                self.headers = OrderedDict(profiles.headers[browser])
+                self.headers['User-Agent'] = self.custom
+                self.cipherSuite = list(profiles.cipher_suites[browser])
+            else:
+                self.cipherSuite = [
+                    ssl._DEFAULT_CIPHERS,
+                    '!AES128-SHA',
+                    '!ECDHE-RSA-AES256-SHA',
+                ]
+                self.headers = OrderedDict([
+                    ('User-Agent', self.custom),
+                    ('Accept', 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8'),
+                    ('Accept-Language', 'en-US,en;q=0.9'),
+                    ('Accept-Encoding', 'gzip, deflate, br')
+                ])
+        else:
+            if self.browser and self.browser not in BROWSERS:
+                raise RuntimeError(
+                    f'Sorry "{self.browser}" browser is not valid, valid browsers are [{", ".join(BROWSERS)}].')
+
+            if not self.platform:
+                self.platform = random.choice(PLATFORMS)
+
+            if self.platform not in PLATFORMS:
+                raise RuntimeError(
+                    f'Sorry the platform "{self.platform}" is not valid, valid platforms are [{", ".join(PLATFORMS)}]')
+
+            pool = profiles.pools[self.platform, bool(self.desktop), bool(self.mobile)]
+            if not self.browser:
+                self.browser = random.choice(tuple(pool))
+
+            agents = pool.get(self.browser)
+            if not agents:
+                raise RuntimeError(f'Sorry "{self.browser}" browser was not found with a platform of "{self.platform}".')
+
+            self.cipherSuite = list(profiles.cipher_suites[self.browser])
+            self.headers = OrderedDict(profiles.headers[self.browser])
+            self.headers['User-Agent'] = random.choice(agents)
+
+        if not kwargs.get('allow_brotli', False) and 'br' in self.headers['Accept-Encoding']:
+            self.headers['Accept-Encoding'] = ','.join([
+                encoding for encoding in self.headers['Accept-Encoding'].split(',') if encoding.strip() != 'br'
+            ]).strip()
+
+
+def install():
+    """Make every CloudScraper created from now on use CachedUserAgent."""
+    cloudscraper.User_Agent = CachedUserAgent
@@ -0,0 +1,51 @@
+# Content-hashed static assets for the apps' inline page templates.
+#
+# The <style> and <script> blocks embedded in HTML_TEMPLATE are pulled out at
+# startup, named by a hash of their content and served from memory with
+# far-future, immutable caching. Pages then only reference them, so browsers
+# download each block once instead of with every page.
+
+import hashlib
+import re
+
+from flask import Response, abort, request
+
+BLOCK_RE = re.compile(r'<(style|script)>(.*?)</\1>', re.S)
+MIMETYPES = {'style': 'text/css', 'script': 'text/javascript'}
+EXTENSIONS = {'style': 'css', 'script': 'js'}
+
+
+class AssetPipeline:
+    """Extracts static blocks from templates and serves them under /assets/."""
+
+    def __init__(self, app, url_prefix='/assets'):
+        self.assets = {}
+        app.add_url_rule(f'{url_prefix}/<name>', 'asset', self.serve)
+
+    def extract(self, source, stem):
+        """Return `source` with every Jinja-free <style>/<script> block replaced by a hashed reference."""
+
+        def replace(match):
+            kind, body = match.groups()
+            if '{{' in body or '{%' in body:
+                return match.group(0)
+            data = body.strip().encode('utf-8')
+            digest = hashlib.sha256(data).hexdigest()[:16]
+            name = f'{stem}.{digest}.{EXTENSIONS[kind]}'
+            self.assets[name] = (data, MIMETYPES[kind], digest)
+            url = "{{ url_for('asset', name='%s') }}" % name
+            if kind == 'style':
+                return f'<link rel="stylesheet" href="{url}">'
+            return f'<script src="{url}"></script>'
+
+        return BLOCK_RE.sub(replace, source)
+
+    def serve(self, name):
+        if name not in self.assets:
+            abort(404)
+        data, mimetype, digest = self.assets[name]
+        response = Response(data, mimetype=mimetype)
+        response.set_etag(digest)
+        # The name changes whenever the content does, so the URL never goes stale
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        return response.make_conditional(request)